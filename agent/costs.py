@@ -1,6 +1,7 @@
 from __future__ import annotations
 
-from typing import Dict
+import sys
+from typing import Dict, Tuple
 
 
 # Tabla simplificada de precios por millón de tokens (EUR aprox., placeholder)
@@ -25,11 +26,20 @@ MODEL_PRICES_EUR_PER_MTOK = {
     "xai:grok-4-0709": {"in": 3, "out": 15},
 }
 
+# Precios por token (entrada, salida), precalculados para evitar divisiones por llamada.
+# Las claves se internan para que la búsqueda con una clave internada compare por identidad.
+MODEL_PRICES_EUR_PER_TOK: Dict[str, Tuple[float, float]] = {
+    sys.intern(k): (v["in"] * 1e-6, v["out"] * 1e-6) for k, v in MODEL_PRICES_EUR_PER_MTOK.items()
+}
+
 
 def estimate_cost_eur(model_key: str, tokens_in: int, tokens_out: int) -> float:
-    prices = MODEL_PRICES_EUR_PER_MTOK.get(model_key)
-    if not prices:
+    # Turnos servidos desde la caché no consumen tokens
+    if tokens_in == 0 and tokens_out == 0:
+        return 0.0
+    p = MODEL_PRICES_EUR_PER_TOK.get(model_key)
+    if p is None:
         return 0.0
-    return (tokens_in / 1_000_000.0) * prices["in"] + (tokens_out / 1_000_000.0) * prices["out"]
+    return tokens_in * p[0] + tokens_out * p[1]
 
 
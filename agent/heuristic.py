@@ -1,9 +1,18 @@
 from __future__ import annotations
 
-from typing import Dict, List
+from typing import List
 
 from sim.engine import AgentProtocol, ToolExecutor
-from sim.types import Action, Observation
+from sim.types import Action, EndTurnAction, GetPricesAction, GetStatusAction, Observation, PlaceOrderAction
+
+
+# Stock objetivo por ingrediente, en orden de importancia a la hora de comprar
+_TARGETS = (("txistorra", 150), ("pan", 80), ("sidra", 40))
+
+
+def _order_action(ing: str, q: int, workers: List[int]) -> PlaceOrderAction:
+    """Acción place_order con el mismo orden de claves siempre (diccionarios con claves compartidas)."""
+    return PlaceOrderAction(type="place_order", quantities={ing: q}, workers=workers)
 
 
 class HeuristicAgent(AgentProtocol):
@@ -21,63 +30,47 @@ class HeuristicAgent(AgentProtocol):
     def play_turn(self, obs: Observation, tools: ToolExecutor) -> List[Action]:
         actions: List[Action] = []
 
-        # Consultar estado y precios
-        tools.get_status()
-        actions.append({"type": "get_status"})
-        tools.get_prices()
-        actions.append({"type": "get_prices"})
-
-        # Heurística simple:
-        # - Intentar mantener: txistorra >= 150, pan >= 80, sidra >= 40
+        # Consultar estado y precios (una sola vez por turno)
+        # Heurística simple: intentar mantener el stock de _TARGETS
         status = tools.get_status()
-        actions.append({"type": "get_status"})
+        actions.append(GetStatusAction(type="get_status"))
         prices = tools.get_prices()
-        actions.append({"type": "get_prices"})
+        actions.append(GetPricesAction(type="get_prices"))
 
         cash = status["cash"]
         stock = status["stock_on_hand"]
 
-        target = {"txistorra": 150, "pan": 80, "sidra": 40}
-        to_buy: Dict[str, int] = {}
-        for ing, tgt in target.items():
-            cur = stock.get(ing, 0)
-            if cur < tgt:
-                to_buy[ing] = max(0, tgt - cur)
-
         # Lista de workers disponibles (no de viaje)
-        workers_on_trip = status.get("workers_on_trip", {}) or {}
-        available_workers = [w for w in range(1, 9) if w not in workers_on_trip]
-
-        # Ajustar según presupuesto (rechazo si coste > caja)
-        # Estrategia: ordenar por importancia y fraccionar si excede caja.
-        importance = ["txistorra", "pan", "sidra"]
-        for ing in importance:
-            qty = to_buy.get(ing, 0)
-            if qty <= 0:
+        trip_keys = frozenset(status.get("workers_on_trip") or ())
+        available_workers = [w for w in range(1, 9) if w not in trip_keys]
+        worker_idx = 0  # siguiente worker disponible para enviar a comprar
+
+        # Ajustar según presupuesto (rechazo si coste > caja) y capacidad de carga de un worker.
+        # La cantidad máxima se calcula directamente: como mucho un place_order por ingrediente.
+        weights = tools.engine.config.ingredient_weights
+        max_carry = tools.engine.config.worker_max_carry_weight
+        for ing, tgt in _TARGETS:
+            qty = tgt - stock.get(ing, 0)
+            if qty <= 0 or worker_idx >= len(available_workers):
+                continue
+            unit_cost = obs["costs"][ing]
+            max_affordable = int((cash - self.safety_cash_buffer) // unit_cost)
+            weight = weights.get(ing, 0.0)
+            max_carried = int((max_carry + 1e-9) / weight) if weight > 0 else qty
+            q = min(qty, max_affordable, max_carried)
+            if q <= 0:
                 continue
-            # Intentar desde qty hacia abajo hasta que quepa en caja - buffer
-            q = qty
-            placed = False
-            while q > 0:
-                if not available_workers:
-                    break
-                selected_workers = [available_workers[0]]
-                res = tools.place_order({ing: q}, selected_workers)
-                actions.append({"type": "place_order", "quantities": {ing: q}, "workers": selected_workers})
-                if res.get("ok") and res.get("accepted"):
-                    placed = True
-                    # actualizar cash local
-                    cash -= q * obs["costs"][ing]
-                    # Marcar worker como de viaje localmente
-                    available_workers = available_workers[1:]
-                    break
-                q = q // 2  # reducir a la mitad y reintentar
-            if not placed:
-                # no fue posible
-                pass
+            selected_workers = [available_workers[worker_idx]]
+            res = tools.place_order({ing: q}, selected_workers)
+            actions.append(_order_action(ing, q, selected_workers))
+            if res.get("ok") and res.get("accepted"):
+                # actualizar cash local
+                cash -= q * unit_cost
+                # Marcar worker como de viaje localmente
+                worker_idx += 1
 
         # Pequeño ajuste de precios: mantener los actuales (no cambiar)
-        actions.append({"type": "end_turn"})
+        actions.append(EndTurnAction(type="end_turn"))
         tools.end_turn()
         return actions
 
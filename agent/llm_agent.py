@@ -1,14 +1,28 @@
 from __future__ import annotations
 
-from typing import List, Optional, Type
+import copy
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Sequence, Tuple, Type
 
-from sim.engine import AgentProtocol, ToolExecutor
+from sim.engine import AgentProtocol, Simulator, ToolExecutor
 from sim.types import Action, Observation
 from .providers.openai import OpenAIResponder
 from .providers.xai import XAIResponder
 from .providers.anthropic import AnthropicResponder
 from .providers.gemini import GeminiResponder
 from .costs import estimate_cost_eur
+from .message_format import format_observation_message
+from .llm_cache import (
+    CacheScope,
+    LLMCache,
+    conversation_delta,
+    conversation_digest,
+    conversation_marks,
+    load_conversation,
+    replay_actions,
+    restore_conversation,
+)
 
 
 # Registro de proveedores soportados.
@@ -27,51 +41,200 @@ class LLMAgent(AgentProtocol):
     """
     Contenedor para un agente LLM con tool calling.
     El contexto se conserva usando previous_response_id almacenado en el engine.
+
+    Si se proporciona una LLMCache y la configuración es determinista (reasoning_effort
+    fijo o temperatura 0), las decisiones se reutilizan para observaciones equivalentes
+    (mismo modelo y mismo contexto previo) sin llamar a la API.
     """
 
-    def __init__(self, provider: str, model: str, reasoning_effort: Optional[str] = None, debug: bool = False):
-        self.provider = provider
+    def __init__(
+        self,
+        provider: str,
+        model: str,
+        reasoning_effort: Optional[str] = None,
+        debug: bool = False,
+        cache: Optional[LLMCache] = None,
+    ):
+        if provider not in PROVIDERS:
+            raise ValueError(f"Proveedor no soportado: {provider}. Opciones: {list(PROVIDERS)}")
+        self.provider = sys.intern(provider)
         self.model = model
         self.reasoning_effort = reasoning_effort
         self.debug = debug
+        self.cache = cache
+        # Clave genérica proveedor:modelo, alineada con agent/costs.py (internada una sola vez)
+        self._model_key = sys.intern(f"{provider}:{model}")
+        # Ámbito de sus decisiones en la caché semántica
+        self._cache_scope: CacheScope = (self.provider, model, reasoning_effort)
+        # El responder (y su cliente HTTP) se construye una sola vez por agente
+        self._responder = self._build_responder()
+        # Solo se cachea con ajustes deterministas: reasoning_effort fijo o temperatura 0
+        self._use_cache = cache is not None and self._is_deterministic()
+        if cache is not None and not self._use_cache:
+            print(f"[cache] {self._model_key} sin reasoning_effort ni temperatura 0: caché desactivada")
 
-    def _build_responder(self) -> Optional[object]:
-        """
-        Construye el responder adecuado según el proveedor configurado.
-
-        Devuelve None si el proveedor no está soportado todavía.
-        """
-        ResponderCls = PROVIDERS.get(self.provider)
-        if ResponderCls is None:
-            return None
+    def _build_responder(self) -> object:
+        """Construye el responder adecuado según el proveedor configurado."""
+        ResponderCls = PROVIDERS[self.provider]
         return ResponderCls(
             model=self.model,
             reasoning_effort=self.reasoning_effort,
             debug=self.debug,
         )
 
+    def _is_deterministic(self) -> bool:
+        """Si las decisiones son reproducibles (y por tanto cacheables) con esta configuración."""
+        return self.reasoning_effort is not None or getattr(self._responder, "temperature", None) == 0
+
     def play_turn(self, obs: Observation, tools: ToolExecutor) -> List[Action]:
-        responder = self._build_responder()
-
-        if responder is not None:
-            # El historial se gestiona en tools.engine.message_history (cuando aplique)
-            actions, tokens_in, tokens_out = responder.decide(obs, tools)
-
-            # Instrumentación básica de tokens/coste (acumulada en el engine)
-            tools.engine.metrics_tokens_in += tokens_in
-            tools.engine.metrics_tokens_out += tokens_out
-
-            # Clave genérica proveedor:modelo, alineada con agent/costs.py
-            model_key = f"{self.provider}:{self.model}"
-            tools.engine.metrics_cost_eur += estimate_cost_eur(model_key, tokens_in, tokens_out)
-            return actions
-
-        # Fallback simple si no hay proveedor reconocido
-        actions: List[Action] = []
-        tools.get_status()
-        actions.append({"type": "get_status"})
-        tools.get_prices()
-        actions.append({"type": "get_prices"})
-        actions.append({"type": "end_turn"})
-        tools.end_turn()
+        responder = self._responder
+
+        cache_key = None
+        if self._use_cache:
+            obs_msg = format_observation_message(obs)
+            cache_key = LLMCache.make_key(
+                self.provider,
+                self.model,
+                self.reasoning_effort,
+                obs_msg,
+                getattr(tools.engine, "previous_response_id", None),
+                conversation_digest(tools.engine),
+            )
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                # Hit: se re-ejecutan las tools para mantener el estado del engine,
+                # sin contabilizar tokens ni coste.
+                restore_conversation(tools.engine, cached["conversation"])
+                if self.debug:
+                    print(f"[cache] hit (hit-rate {self.cache.hit_rate:.0%})")
+                return replay_actions(cached["actions"], tools)
+            # Segundo nivel: observación casi idéntica del mismo proveedor/modelo/reasoning_effort.
+            # No se aplica en turnos con razonamiento "high" para no sacrificar calidad
+            # en decisiones críticas (y por eso tampoco se calcula su embedding al guardar),
+            # ni con responders que no sepan registrar el turno en su conversación.
+            semantic = self.reasoning_effort != "high" and hasattr(responder, "record_replayed_turn")
+            if semantic:
+                similar = self.cache.semantic_get(obs_msg, scope=self._cache_scope)
+                if similar is not None:
+                    if self.debug:
+                        print(f"[cache] hit semántico ({self.cache.stats['semantic_hits']} en total)")
+                    actions = replay_actions(similar["actions"], tools)
+                    # La decisión venía de otra conversación: el proveedor añade este turno a la suya
+                    responder.record_replayed_turn(obs, actions, tools)
+                    return actions
+            marks = conversation_marks(tools.engine)
+
+        # El historial se gestiona en tools.engine.message_history (cuando aplique)
+        actions, tokens_in, tokens_out = responder.decide(obs, tools)
+
+        if cache_key is not None:
+            self.cache.set(
+                cache_key,
+                {
+                    "actions": actions,
+                    "tokens_in": tokens_in,
+                    "tokens_out": tokens_out,
+                    "conversation": conversation_delta(tools.engine, marks),
+                },
+                obs_msg=obs_msg if semantic else None,
+                scope=self._cache_scope,
+            )
+            if self.debug:
+                print(f"[cache] miss (hit-rate {self.cache.hit_rate:.0%})")
+
+        # Instrumentación básica de tokens/coste (acumulada en el engine)
+        tools.engine.metrics_tokens_in += tokens_in
+        tools.engine.metrics_tokens_out += tokens_out
+
+        tools.engine.metrics_cost_eur += estimate_cost_eur(self._model_key, tokens_in, tokens_out)
         return actions
+
+
+class EnsembleLLMAgent(AgentProtocol):
+    """
+    Agente para comparar varios proveedores/modelos (A/B) en el mismo turno.
+
+    Todos los miembros deciden a la vez sobre la misma observación: cada LLMAgent.play_turn
+    corre en un hilo de un pool persistente, de modo que la latencia del turno es la del
+    modelo más lento y no la suma de todos.
+
+    Solo el primer miembro (primario) actúa sobre el simulador real. Cada secundario tiene
+    su propio engine en la sombra (con su conversación, traza y métricas) al que en cada
+    turno se copia solo el estado del simulador. Sus acciones, tokens y coste se guardan
+    en `member_metrics` / `last_member_actions`, indexados por posición del miembro.
+    """
+
+    def __init__(
+        self,
+        members: Sequence[Tuple[str, str]],
+        reasoning_effort: Optional[str] = None,
+        debug: bool = False,
+        cache: Optional[LLMCache] = None,
+    ):
+        if not members:
+            raise ValueError("EnsembleLLMAgent necesita al menos un par (provider, model)")
+        self.agents = [
+            LLMAgent(provider=provider, model=model, reasoning_effort=reasoning_effort, debug=debug, cache=cache)
+            for provider, model in members
+        ]
+        self.debug = debug
+        # Los SDK de los proveedores son síncronos: un hilo por miembro, reutilizados entre turnos
+        self._executor = ThreadPoolExecutor(max_workers=len(self.agents), thread_name_prefix="ensemble")
+        # Engine en la sombra de cada miembro secundario (índice -> engine), persistente entre turnos
+        self._shadow_engines: Dict[int, Simulator] = {}
+        self.member_metrics: Dict[int, Dict[str, Any]] = {
+            idx: {"model": agent._model_key, "tokens_in": 0, "tokens_out": 0, "cost_eur": 0.0}
+            for idx, agent in enumerate(self.agents)
+        }
+        self.last_member_actions: Dict[int, List[Action]] = {}
+
+    def _shadow_tools(self, idx: int, tools: ToolExecutor) -> ToolExecutor:
+        """Engine propio del miembro `idx` con una copia del estado actual del simulador."""
+        shadow = self._shadow_engines.get(idx)
+        if shadow is None:
+            # Comparte config, tablas de demanda y rng (solo lectura: la sombra nunca avanza
+            # de turno); conversación, traza y métricas empiezan vacías
+            shadow = copy.copy(tools.engine)
+            shadow.reset()
+            load_conversation(shadow, {})
+            self._shadow_engines[idx] = shadow
+        shadow.state = copy.deepcopy(tools.engine.state)
+        shadow.agent_actions_trace = []
+        shadow._end_turn_requested = False
+        return ToolExecutor(shadow)
+
+    def _play_member(self, idx: int, obs: Observation, tools: ToolExecutor) -> Tuple[List[Action], int, int, float]:
+        """play_turn de un miembro (caché y coste incluidos); devuelve sus acciones y consumo del turno."""
+        engine = tools.engine
+        tokens_in, tokens_out, cost = engine.metrics_tokens_in, engine.metrics_tokens_out, engine.metrics_cost_eur
+        actions = self.agents[idx].play_turn(obs, tools)
+        return (
+            actions,
+            engine.metrics_tokens_in - tokens_in,
+            engine.metrics_tokens_out - tokens_out,
+            engine.metrics_cost_eur - cost,
+        )
+
+    def play_turn(self, obs: Observation, tools: ToolExecutor) -> List[Action]:
+        # Las copias se toman antes de que el primario empiece a modificar el engine real
+        member_tools = [tools] + [self._shadow_tools(i, tools) for i in range(1, len(self.agents))]
+        futures = [
+            self._executor.submit(self._play_member, idx, obs, agent_tools)
+            for idx, agent_tools in enumerate(member_tools)
+        ]
+        results = [future.result() for future in futures]
+
+        for idx, (actions, tokens_in, tokens_out, cost) in enumerate(results):
+            metrics = self.member_metrics[idx]
+            metrics["tokens_in"] += tokens_in
+            metrics["tokens_out"] += tokens_out
+            metrics["cost_eur"] += cost
+            self.last_member_actions[idx] = actions
+            if self.debug:
+                print(f"[ensemble] #{idx} {metrics['model']}: {len(actions)} acciones, {tokens_in}/{tokens_out} tokens")
+
+        # El primario ya ha contabilizado sus tokens y coste en el engine real (LLMAgent.play_turn)
+        return results[0][0]
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=True)
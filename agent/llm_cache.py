@@ -0,0 +1,372 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import pathlib
+import shelve
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+import orjson
+
+from sim.engine import ToolExecutor
+from sim.types import Action
+from .tool_calls import END_TURN_ACTION
+
+
+# Atributos del engine donde los proveedores guardan el estado de la conversación.
+# Los escalares se restauran tal cual; las listas de historial se extienden con
+# los mensajes que se añadieron durante el turno cacheado.
+_CONVERSATION_SCALARS = ("previous_response_id", "pending_tool_outputs")
+_CONVERSATION_HISTORIES = ("anthropic_messages", "gemini_messages")
+
+
+class MemoryBackend:
+    """Backend LRU en memoria (OrderedDict) con número máximo de entradas."""
+
+    def __init__(self, max_entries: int = 1024):
+        self.max_entries = max_entries
+        self._data: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        entry = self._data.get(key)
+        if entry is not None:
+            self._data.move_to_end(key)
+        return entry
+
+    def set(self, key: str, entry: Dict[str, Any]) -> None:
+        self._data[key] = entry
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_entries:
+            self._data.popitem(last=False)
+
+    def delete(self, key: str) -> None:
+        self._data.pop(key, None)
+
+    def items(self) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        return iter(list(self._data.items()))
+
+    def close(self) -> None:
+        pass
+
+
+class ShelveBackend:
+    """Backend persistente en disco basado en shelve (sobrevive entre ejecuciones)."""
+
+    def __init__(self, path: str | pathlib.Path):
+        self._db = shelve.open(str(path))
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        return self._db.get(key)
+
+    def set(self, key: str, entry: Dict[str, Any]) -> None:
+        self._db[key] = entry
+        self._db.sync()
+
+    def delete(self, key: str) -> None:
+        if key in self._db:
+            del self._db[key]
+
+    def items(self) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        return iter(list(self._db.items()))
+
+    def close(self) -> None:
+        self._db.close()
+
+
+class SentenceTransformerEmbedder:
+    """
+    Embeddings locales con sentence-transformers (por defecto all-MiniLM-L6-v2).
+
+    El modelo se carga en la primera llamada; sentence-transformers no es una
+    dependencia obligatoria del simulador.
+    """
+
+    def __init__(self, model_name: str = "sentence-transformers/all-MiniLM-L6-v2"):
+        self.model_name = model_name
+        self._model: Any = None
+
+    def __call__(self, text: str) -> np.ndarray:
+        if self._model is None:
+            try:
+                from sentence_transformers import SentenceTransformer
+            except ImportError as exc:
+                raise RuntimeError(
+                    "La caché semántica necesita sentence-transformers (pip install sentence-transformers)"
+                ) from exc
+            self._model = SentenceTransformer(self.model_name)
+        return np.asarray(self._model.encode(text), dtype=np.float32)
+
+
+# Ámbito de una decisión para la caché semántica: (provider, model, reasoning_effort).
+# Solo se reutilizan decisiones del mismo ámbito, igual que en la clave exacta.
+CacheScope = Tuple[str, str, Optional[str]]
+
+
+class _SemanticPartition:
+    """Embeddings de un ámbito: clave -> vector, con la matriz apilada bajo demanda."""
+
+    def __init__(self) -> None:
+        self.vectors: Dict[str, np.ndarray] = {}
+        self._matrix: Optional[Tuple[List[str], np.ndarray]] = None
+
+    def put(self, key: str, vector: np.ndarray) -> None:
+        # Una clave ya indexada se sustituye (no se duplica la fila)
+        self.vectors[key] = vector
+        self._matrix = None
+
+    def discard(self, key: str) -> None:
+        if self.vectors.pop(key, None) is not None:
+            self._matrix = None
+
+    def matrix(self) -> Tuple[List[str], np.ndarray]:
+        if self._matrix is None:
+            self._matrix = (list(self.vectors), np.vstack(list(self.vectors.values())))
+        return self._matrix
+
+
+class LLMCache:
+    """
+    Caché de decisiones de un LLMAgent: (acciones, tokens_in, tokens_out).
+
+    Pensada para ejecuciones reproducibles: si la misma observación llega con
+    el mismo proveedor/modelo/reasoning_effort y el mismo contexto previo,
+    se reutiliza la decisión anterior sin llamar a la API.
+
+    Si se pasa un `embedder`, se activa un segundo nivel semántico: ante un fallo
+    exacto se busca la observación más parecida (similitud coseno sobre embeddings
+    normalizados) del mismo ámbito (provider, model, reasoning_effort) y, si supera
+    `semantic_threshold`, se reutiliza su decisión.
+
+    Es thread-safe: varios agentes (p. ej. los miembros de un ensemble) pueden compartirla.
+    """
+
+    def __init__(
+        self,
+        backend: Any = None,
+        ttl: Optional[float] = 3600,
+        embedder: Optional[Callable[[str], np.ndarray]] = None,
+        semantic_threshold: float = 0.92,
+    ):
+        self.backend = backend if backend is not None else MemoryBackend()
+        self.ttl = ttl
+        self.embedder = embedder
+        self.semantic_threshold = semantic_threshold
+        self.stats = {"hits": 0, "misses": 0, "semantic_hits": 0}
+        # Índice semántico particionado por ámbito (se completa con el backend bajo demanda)
+        self._semantic_index: Dict[Optional[CacheScope], _SemanticPartition] = {}
+        self._semantic_loaded = False
+        self._last_embedding: Optional[Tuple[str, np.ndarray]] = None
+        self._lock = threading.RLock()
+
+    @staticmethod
+    def make_key(
+        provider: str,
+        model: str,
+        reasoning_effort: Optional[str],
+        obs_msg: str,
+        previous_response_id: Optional[str],
+        history_digest: Optional[str] = None,
+    ) -> str:
+        """
+        Clave de una decisión. Los proveedores con historial local (Anthropic, Gemini) no tienen
+        previous_response_id: su contexto previo entra en la clave como `history_digest`.
+        """
+        payload = {
+            "provider": provider,
+            "model": model,
+            "reasoning_effort": reasoning_effort,
+            "obs_msg": obs_msg,
+            "prev_response_id": previous_response_id,
+        }
+        if history_digest is not None:
+            payload["history"] = history_digest
+        return hashlib.sha256(json.dumps(payload, sort_keys=True).encode()).hexdigest()
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.stats["hits"] + self.stats["misses"]
+        return self.stats["hits"] / total if total else 0.0
+
+    def _get_entry(self, key: str) -> Optional[Dict[str, Any]]:
+        entry = self.backend.get(key)
+        if entry is not None and entry["expires_at"] is not None and entry["expires_at"] < time.time():
+            self.backend.delete(key)
+            entry = None
+        return entry
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            entry = self._get_entry(key)
+            if entry is None:
+                self.stats["misses"] += 1
+                return None
+            self.stats["hits"] += 1
+            return entry["value"]
+
+    def set(
+        self,
+        key: str,
+        value: Dict[str, Any],
+        ttl: Optional[float] = None,
+        obs_msg: Optional[str] = None,
+        scope: Optional[CacheScope] = None,
+    ) -> None:
+        """
+        Guarda una decisión. Solo se indexa semánticamente si hay embedder y `obs_msg`
+        (quien no vaya a usar el nivel semántico no debe pasarlo: el embedding es caro).
+        """
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = time.time() + ttl if ttl is not None else None
+        entry: Dict[str, Any] = {"value": value, "expires_at": expires_at, "scope": scope}
+        with self._lock:
+            if self.embedder is not None and obs_msg is not None:
+                embedding = self._embed(obs_msg)
+                entry["embedding"] = embedding
+                self._semantic_index.setdefault(scope, _SemanticPartition()).put(key, embedding)
+            self.backend.set(key, entry)
+
+    def _embed(self, text: str) -> np.ndarray:
+        """Embedding L2-normalizado (memoiza el último texto: get y set van seguidos)."""
+        if self._last_embedding is not None and self._last_embedding[0] == text:
+            return self._last_embedding[1]
+        vec = np.asarray(self.embedder(text), dtype=np.float32).ravel()
+        norm = float(np.linalg.norm(vec))
+        if norm > 0:
+            vec = vec / norm
+        self._last_embedding = (text, vec)
+        return vec
+
+    def _load_semantic_index(self) -> None:
+        """Incorpora al índice las entradas con embedding ya presentes en el backend."""
+        for key, entry in self.backend.items():
+            embedding = entry.get("embedding")
+            if embedding is None:
+                continue
+            scope = entry.get("scope")
+            if scope is not None:
+                scope = tuple(scope)
+            partition = self._semantic_index.setdefault(scope, _SemanticPartition())
+            if key not in partition.vectors:
+                partition.put(key, embedding)
+        self._semantic_loaded = True
+
+    def semantic_get(self, obs_msg: str, scope: Optional[CacheScope] = None) -> Optional[Dict[str, Any]]:
+        """
+        Devuelve la decisión más parecida del mismo ámbito si supera el umbral.
+
+        Las entradas de otro proveedor/modelo/reasoning_effort nunca se consideran.
+        """
+        if self.embedder is None:
+            return None
+        with self._lock:
+            if not self._semantic_loaded:
+                self._load_semantic_index()
+            partition = self._semantic_index.get(scope)
+            if partition is None or not partition.vectors:
+                return None
+            keys, matrix = partition.matrix()
+            sims = matrix @ self._embed(obs_msg)
+            best = int(np.argmax(sims))
+            if float(sims[best]) <= self.semantic_threshold:
+                return None
+            entry = self._get_entry(keys[best])
+            if entry is None:
+                # Entrada expirada: se descarta del índice
+                partition.discard(keys[best])
+                return None
+            self.stats["semantic_hits"] += 1
+            return entry["value"]
+
+    def close(self) -> None:
+        self.backend.close()
+
+
+def conversation_marks(engine: Any) -> Dict[str, int]:
+    """Longitud de cada historial de mensajes antes de que el agente decida."""
+    return {attr: len(getattr(engine, attr, None) or []) for attr in _CONVERSATION_HISTORIES}
+
+
+def _history_default(obj: Any) -> Any:
+    """Serialización de los mensajes de los SDK (modelos pydantic) para la huella del historial."""
+    dump = getattr(obj, "model_dump", None)
+    if dump is not None:
+        return dump(mode="json", exclude_none=True)
+    return repr(obj)
+
+
+def conversation_digest(engine: Any) -> Optional[str]:
+    """Huella (sha256) de los historiales locales del engine; None si están vacíos."""
+    h = hashlib.sha256()
+    found = False
+    for attr in _CONVERSATION_HISTORIES:
+        history = getattr(engine, attr, None)
+        if history:
+            found = True
+            h.update(attr.encode())
+            h.update(orjson.dumps(history, default=_history_default, option=orjson.OPT_NON_STR_KEYS))
+    return h.hexdigest() if found else None
+
+
+def conversation_delta(engine: Any, marks: Dict[str, int]) -> Dict[str, Any]:
+    """Estado de la conversación generado durante el turno (para poder restaurarlo)."""
+    delta: Dict[str, Any] = {attr: getattr(engine, attr, None) for attr in _CONVERSATION_SCALARS}
+    for attr, start in marks.items():
+        delta[attr] = list((getattr(engine, attr, None) or [])[start:])
+    return delta
+
+
+def restore_conversation(engine: Any, delta: Dict[str, Any]) -> None:
+    """Aplica sobre el engine el estado de conversación guardado en la caché."""
+    for attr in _CONVERSATION_SCALARS:
+        if attr in delta:
+            setattr(engine, attr, delta[attr])
+    for attr in _CONVERSATION_HISTORIES:
+        new_messages = delta.get(attr) or []
+        if new_messages:
+            history = getattr(engine, attr, None) or []
+            history.extend(new_messages)
+            setattr(engine, attr, history)
+
+
+def load_conversation(engine: Any, snapshot: Dict[str, Any]) -> None:
+    """Sustituye la conversación del engine por la de un snapshot (vacía si no existe)."""
+    engine.previous_response_id = snapshot.get("previous_response_id")
+    engine.pending_tool_outputs = list(snapshot.get("pending_tool_outputs") or [])
+    for attr in _CONVERSATION_HISTORIES:
+        setattr(engine, attr, list(snapshot.get(attr) or []))
+
+
+# Argumentos de cada tool dentro de una acción cacheada: (campo, copia). Se copian
+# para que el simulador no comparta contenedores con la entrada de la caché.
+_REPLAY_ARGS: Dict[str, Tuple[Tuple[str, Callable[[Any], Any]], ...]] = {
+    "get_status": (),
+    "get_prices": (),
+    "set_prices": (("prices", dict),),
+    "place_order": (("quantities", dict), ("workers", list)),
+    "assign_workers": (("assignments", list),),
+    "end_turn": (),
+}
+
+
+def replay_actions(actions: List[Action], tools: ToolExecutor) -> List[Action]:
+    """
+    Re-ejecuta contra el simulador las acciones de una decisión cacheada,
+    para que el estado del engine quede igual que si el modelo hubiera respondido.
+    """
+    replayed: List[Action] = []
+    for action in actions:
+        action_type = action["type"]
+        fields = _REPLAY_ARGS.get(action_type)
+        if fields is None:
+            continue
+        kwargs = {field: copy(action[field]) for field, copy in fields}
+        getattr(tools, action_type)(call_id=f"cache_{action_type}", **kwargs)
+        replayed.append(action)
+    if not replayed or replayed[-1]["type"] != "end_turn":
+        tools.end_turn(call_id="cache_end_turn")
+        replayed.append(END_TURN_ACTION)
+    return replayed
@@ -1,65 +1,68 @@
 from __future__ import annotations
 
-from typing import Any, List
+import sys
+from typing import Any, List, Mapping
 
 from sim.types import Observation
 
+# Textos fijos del mensaje, internados una sola vez al importar el módulo
+_MSG_TIME_PREFIX = sys.intern("Hora: ")
+_MSG_NO_ORDERS_SERVED = sys.intern("En los últimos 15 minutos no se ha servido ningún pedido.")
+_MSG_NO_UNSERVED = sys.intern("No ha quedado ningún pedido sin atender por capacidad.")
+_MSG_ORDERS_SERVED_HEADER = sys.intern("Pedidos servidos en los últimos 15 minutos:")
+_MSG_UNSERVED_HEADER = sys.intern("Pedidos que no han podido ser atendidos por capacidad:")
+
+# Plantillas del mensaje, compiladas una sola vez al importar el módulo
+_HEADER_TEMPLATE = _MSG_TIME_PREFIX + "{time}\n\nHay {queue_len} personas esperando para pedir en la cola del puesto."
+_DROPPED_TEMPLATES = (
+    "{n} persona se han ido de la cola porque llevaban más de media hora esperando.",
+    "{n} personas se han ido de la cola porque llevaban más de media hora esperando.",
+)
+
+# Contenedores vacíos compartidos para campos ausentes (nunca se modifican)
+_EMPTY_DICT: Mapping[str, Any] = {}
+_EMPTY_LIST: List[Any] = []
+
+
+def _fmt_items(items: Mapping[str, Any]) -> str:
+    """Une los items de un pedido (producto -> unidades) como '2 pintxo, 1 sidra'."""
+    # join materializa la secuencia igualmente: una list comprehension evita el generador
+    return ", ".join([f"{int(qty)} {prod}" for prod, qty in items.items()])
+
+
+def _fmt_orders(header: str, orders: List[Any]) -> str:
+    """Sección de pedidos: cabecera y una línea por pedido, unidas de una vez."""
+    lines = [header]
+    lines.extend([
+        f"- Pedido {i}: {_fmt_items(order.get('items', order) if isinstance(order, dict) else _EMPTY_DICT)}"
+        for i, order in enumerate(orders, 1)
+    ])
+    return "\n".join(lines)
+
 
 def format_observation_message(o: Observation) -> str:
     """
     Formatea una Observation en el mismo mensaje de usuario
     que se envía a los modelos de IA.
+
+    Cada sección (párrafo) se construye de una vez y se unen con una línea en blanco.
     """
     time_str = o.get("time", "")
-    lts = o.get("last_turn_summary", {}) or {}
-    queue_len = int(lts.get("queue_end") or 0)
-    dropped_from_queue = int(lts.get("dropped_from_queue") or 0)
-    info_messages = lts.get("messages", []) or []
-    orders_served = lts.get("orders_served", []) or []
-    unserved_orders = lts.get("unserved_orders", []) or []
-
-    lines: List[str] = []
-    lines.append(f"Hora: {time_str}")
-    lines.append("")
-    lines.append(f"Hay {queue_len} personas esperando para pedir en la cola del puesto.")
-
-    for msg in info_messages:
-        lines.append("")
-        lines.append(msg)
-    if not info_messages and dropped_from_queue > 0:
-        lines.append("")
-        lines.append(
-            f"{dropped_from_queue} persona{'s' if dropped_from_queue != 1 else ''} se han ido de la cola porque llevaban más de media hora esperando."
-        )
-
-    if orders_served:
-        lines.append("")
-        lines.append("Pedidos servidos en los últimos 15 minutos:")
-        for i, order in enumerate(orders_served, 1):
-            items: dict[str, Any] = {}
-            if isinstance(order, dict):
-                items = order.get("items", order)
-            parts = [f"{int(qty)} {prod}" for prod, qty in items.items()]
-            lines.append(f"- Pedido {i}: " + ", ".join(parts))
-    else:
-        lines.append("")
-        lines.append("En los últimos 15 minutos no se ha servido ningún pedido.")
-
-    if unserved_orders:
-        lines.append("")
-        lines.append("Pedidos que no han podido ser atendidos por capacidad:")
-        for i, order in enumerate(unserved_orders, 1):
-            items: dict[str, Any] = {}
-            if isinstance(order, dict):
-                items = order.get("items", order)
-            parts = [f"{int(qty)} {prod}" for prod, qty in items.items()]
-            lines.append(f"- Pedido {i}: " + ", ".join(parts))
-    else:
-        lines.append("")
-        lines.append("No ha quedado ningún pedido sin atender por capacidad.")
-
-    return "\n".join(lines)
+    lts = o.get("last_turn_summary") or _EMPTY_DICT
+    lts_get = lts.get  # un solo lookup del método para los cinco campos
+    queue_len = int(lts_get("queue_end") or 0)
+    dropped_from_queue = int(lts_get("dropped_from_queue") or 0)
+    info_messages = lts_get("messages") or _EMPTY_LIST
+    orders_served = lts_get("orders_served") or _EMPTY_LIST
+    unserved_orders = lts_get("unserved_orders") or _EMPTY_LIST
 
+    sections: List[str] = [_HEADER_TEMPLATE.format(time=time_str, queue_len=queue_len)]
 
+    sections.extend(info_messages)
+    if not info_messages and dropped_from_queue > 0:
+        sections.append(_DROPPED_TEMPLATES[dropped_from_queue != 1].format(n=dropped_from_queue))
 
+    sections.append(_fmt_orders(_MSG_ORDERS_SERVED_HEADER, orders_served) if orders_served else _MSG_NO_ORDERS_SERVED)
+    sections.append(_fmt_orders(_MSG_UNSERVED_HEADER, unserved_orders) if unserved_orders else _MSG_NO_UNSERVED)
 
+    return "\n\n".join(sections)
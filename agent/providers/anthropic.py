@@ -1,32 +1,38 @@
 from __future__ import annotations
 
-import json
+import contextlib
 import os
-import pathlib
-from typing import Any, Dict, List, Tuple
+import threading
+import time
+import types
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, ClassVar, Dict, Iterator, List, Optional, Tuple
 
-import yaml
+import orjson
 from dotenv import load_dotenv
-from anthropic import Anthropic
+from anthropic import Anthropic, RateLimitError
 
 from sim.engine import ToolExecutor
 from sim.types import Action, Observation
+from ..message_format import format_observation_message
+from ..tool_calls import END_TURN_ACTION, ToolDispatch, build_tool_dispatch, execute_tool_call
+from .common import load_system_prompt, load_tools_config, replayed_turn_text, short_json, tool_result_json
 
 load_dotenv()
 
+# Endpoint beta con interleaved-thinking (razonamiento entre llamadas a tools)
+_BETAS = ["interleaved-thinking-2025-05-14"]
 
-def _project_root() -> pathlib.Path:
-    return pathlib.Path(__file__).resolve().parents[2]
+# Marca de prompt caching: el prefijo hasta el bloque marcado se cachea en Anthropic
+_EPHEMERAL = {"type": "ephemeral"}
 
+# Aproximación de bytes de JSON por token para estimar el TPM antes de cada petición
+_BYTES_PER_TOKEN = 4
 
-def _load_system_prompt() -> str:
-    p = _project_root() / "configs" / "prompts" / "system.txt"
-    return p.read_text(encoding="utf-8").strip()
 
-
-def _load_tools_config() -> Dict[str, Any]:
-    p = _project_root() / "configs" / "tools.yml"
-    return yaml.safe_load(p.read_text(encoding="utf-8"))
+# Definición de tools en formato Anthropic: (tools_cfg de origen, tools transformadas).
+# load_tools_config devuelve el mismo objeto mientras tools.yml no cambie.
+_TOOLS_DEF_CACHE: Optional[Tuple[Dict[str, Any], List[Dict[str, Any]]]] = None
 
 
 def _to_anthropic_tools(tools_cfg: Dict[str, Any]) -> List[Dict[str, Any]]:
@@ -45,6 +51,63 @@ def _to_anthropic_tools(tools_cfg: Dict[str, Any]) -> List[Dict[str, Any]]:
     return tools
 
 
+def _get_cached_tools_def() -> List[Dict[str, Any]]:
+    """
+    Tools en formato Anthropic, transformadas una sola vez mientras tools.yml no cambie.
+
+    La lista es compartida entre turnos y responders: de solo lectura.
+    """
+    global _TOOLS_DEF_CACHE
+    tools_cfg = load_tools_config()
+    cached = _TOOLS_DEF_CACHE
+    if cached is None or cached[0] is not tools_cfg:
+        tools_def = _to_anthropic_tools(tools_cfg)
+        # Punto de caché tras la última tool: la definición de tools no cambia entre llamadas
+        if tools_def:
+            tools_def[-1] = {**tools_def[-1], "cache_control": _EPHEMERAL}
+        cached = (tools_cfg, tools_def)
+        _TOOLS_DEF_CACHE = cached
+    return cached[1]
+
+
+@contextlib.contextmanager
+def _cache_breakpoint(messages: List[Dict[str, Any]]) -> Iterator[None]:
+    """
+    Marca con cache_control el último bloque del historial mientras se envía la petición,
+    para que el historial hasta ese punto se lea de la caché en la siguiente llamada.
+
+    La marca se pone y se quita en el sitio (O(1)): el historial no se copia en cada
+    petición y el guardado en el engine no acumula marcas.
+    """
+    if not messages:
+        yield
+        return
+    last = messages[-1]
+    content = last["content"]
+    if isinstance(content, str):
+        last["content"] = [{"type": "text", "text": content, "cache_control": _EPHEMERAL}]
+        try:
+            yield
+        finally:
+            last["content"] = content
+    else:
+        block = content[-1]
+        block["cache_control"] = _EPHEMERAL
+        try:
+            yield
+        finally:
+            del block["cache_control"]
+
+
+def _input_tokens(usage: Any) -> int:
+    """Tokens de entrada totales, incluidos los escritos y leídos de la caché de prompts."""
+    return (
+        usage.input_tokens
+        + (usage.cache_creation_input_tokens or 0)
+        + (usage.cache_read_input_tokens or 0)
+    )
+
+
 class AnthropicResponder:
     """
     Adaptador de la API de Anthropic (Messages API) al simulador.
@@ -55,6 +118,24 @@ class AnthropicResponder:
     - Historial de mensajes entre turnos
     """
 
+    __slots__ = ("model", "reasoning_effort", "temperature", "debug", "client", "_thinking_budgets", "_block_handlers")
+
+    # Un único cliente (y pool de conexiones HTTP keep-alive) por API key para todos los responders
+    _shared_clients: ClassVar[Dict[str, Anthropic]] = {}
+    _shared_clients_lock: ClassVar[threading.Lock] = threading.Lock()
+
+    @classmethod
+    def _get_client(cls) -> Anthropic:
+        api_key = os.getenv("ANTHROPIC_API_KEY")
+        if not api_key:
+            raise RuntimeError("ANTHROPIC_API_KEY no está configurada")
+        with cls._shared_clients_lock:
+            client = cls._shared_clients.get(api_key)
+            if client is None:
+                client = Anthropic(api_key=api_key)
+                cls._shared_clients[api_key] = client
+            return client
+
     def __init__(
         self,
         model: str,
@@ -67,11 +148,7 @@ class AnthropicResponder:
         self.temperature = temperature
         self.debug = debug
 
-        api_key = os.getenv("ANTHROPIC_API_KEY")
-        if not api_key:
-            raise RuntimeError("ANTHROPIC_API_KEY no está configurada")
-
-        self.client = Anthropic(api_key=api_key)
+        self.client = self._get_client()
 
         # Mapeo de reasoning_effort a budget_tokens
         self._thinking_budgets = {
@@ -80,124 +157,64 @@ class AnthropicResponder:
             "high": 32000,
         }
 
-    def _format_observation_message(self, o: Observation) -> str:
-        """Formatea una observación como mensaje de usuario."""
-        time_str = o.get("time", "")
-        lts = o.get("last_turn_summary", {}) or {}
-        queue_len = int(lts.get("queue_end", 0))
-        dropped_from_queue = int(lts.get("dropped_from_queue", 0))
-        info_messages = lts.get("messages", []) or []
-        orders_served = lts.get("orders_served", []) or []
-        unserved_orders = lts.get("unserved_orders", []) or []
-
-        lines: List[str] = []
-        lines.append(f"Hora: {time_str}")
-        lines.append("")
-        lines.append(f"Hay {queue_len} personas esperando para pedir en la cola del puesto.")
-
-        for msg in info_messages:
-            lines.append("")
-            lines.append(msg)
-        if not info_messages and dropped_from_queue > 0:
-            lines.append("")
-            lines.append(
-                f"{dropped_from_queue} persona{'s' if dropped_from_queue != 1 else ''} se han ido de la cola porque llevaban más de media hora esperando."
-            )
-
-        if orders_served:
-            lines.append("")
-            lines.append("Pedidos servidos en los últimos 15 minutos:")
-            for i, order in enumerate(orders_served, 1):
-                items: Dict[str, Any] = {}
-                if isinstance(order, dict):
-                    items = order.get("items", order)
-                parts = [f"{int(qty)} {prod}" for prod, qty in items.items()]
-                lines.append(f"- Pedido {i}: " + ", ".join(parts))
-        else:
-            lines.append("")
-            lines.append("En los últimos 15 minutos no se ha servido ningún pedido.")
-
-        if unserved_orders:
-            lines.append("")
-            lines.append("Pedidos que no han podido ser atendidos por capacidad:")
-            for i, order in enumerate(unserved_orders, 1):
-                items: Dict[str, Any] = {}
-                if isinstance(order, dict):
-                    items = order.get("items", order)
-                parts = [f"{int(qty)} {prod}" for prod, qty in items.items()]
-                lines.append(f"- Pedido {i}: " + ", ".join(parts))
-        else:
-            lines.append("")
-            lines.append("No ha quedado ningún pedido sin atender por capacidad.")
-
-        return "\n".join(lines)
-
-    def _execute_tool(
-        self, name: str, args: Dict[str, Any], tool_use_id: str, tools: ToolExecutor
-    ) -> Tuple[Dict[str, Any], Action | None]:
-        """Ejecuta una tool en el simulador y devuelve (resultado, acción)."""
-        if name == "get_status":
-            res = tools.get_status(call_id=tool_use_id, arguments={})
-            return res, {"type": "get_status"}
-        elif name == "get_prices":
-            res = tools.get_prices(call_id=tool_use_id, arguments={})
-            return res, {"type": "get_prices"}
-        elif name == "set_prices":
-            prices_list = args.get("prices") or []
-            prices = {}
-            for it in prices_list:
-                product = it.get("product")
-                price = it.get("price")
-                if product and price is not None:
-                    prices[product] = float(price)
-            res = tools.set_prices(prices, call_id=tool_use_id, arguments=args)
-            return res, {"type": "set_prices", "prices": prices}
-        elif name == "place_order":
-            items_list = args.get("items") or []
-            quantities = {}
-            for it in items_list:
-                ingredient = it.get("ingredient")
-                quantity = it.get("quantity")
-                if ingredient and quantity is not None:
-                    quantities[ingredient] = int(float(quantity))
-            workers = [int(w) for w in (args.get("workers") or []) if w is not None]
-            res = tools.place_order(quantities, workers, call_id=tool_use_id, arguments=args)
-            return res, {"type": "place_order", "quantities": quantities, "workers": workers}
-        elif name == "assign_workers":
-            assignments_list = args.get("assignments") or []
-            assignments = []
-            for it in assignments_list:
-                emp_id = it.get("employee_id")
-                task = it.get("task")
-                if emp_id is not None and task is not None:
-                    assignments.append({"employee_id": int(emp_id), "task": task})
-            res = tools.assign_workers(assignments, call_id=tool_use_id, arguments=args)
-            return res, {"type": "assign_workers", "assignments": assignments}
-        elif name == "end_turn":
-            res = tools.end_turn(call_id=tool_use_id, arguments={})
-            return res, {"type": "end_turn"}
-        else:
-            return {"ok": False, "reason": f"Tool desconocida: {name}"}, None
+        # Procesado de bloques de la respuesta según su tipo (el resto se ignora)
+        self._block_handlers = {
+            "text": self._handle_text_block,
+            "thinking": self._handle_thinking_block,
+            "tool_use": self._handle_tool_use_block,
+        }
 
-    def decide(
-        self,
-        obs: Observation,
-        tools: ToolExecutor,
-        history: List[Observation] | None = None,
-    ) -> Tuple[List[Action], int, int]:
-        """
-        Ejecuta un bucle de tool-calling hasta que el modelo invoque end_turn.
+    def _handle_text_block(
+        self, block: Any, assistant_content: List[Dict[str, Any]], tool_uses: List[Dict[str, Any]], tools: ToolExecutor
+    ) -> None:
+        text = block.text
+        assistant_content.append({"type": "text", "text": text})
+        if self.debug:
+            print(f"  -> texto: {text[:100]}...")
+
+    def _handle_thinking_block(
+        self, block: Any, assistant_content: List[Dict[str, Any]], tool_uses: List[Dict[str, Any]], tools: ToolExecutor
+    ) -> None:
+        thinking_text = block.thinking
+        # Incluir en el historial para que Anthropic pueda validar
+        assistant_content.append({
+            "type": "thinking",
+            "thinking": thinking_text,
+            "signature": block.signature,
+        })
+        # Registrar en la traza de razonamiento (sin guardar el signature/id, sin truncar)
+        tools.engine.agent_actions_trace.append({
+            "type": "reasoning",
+            "summary": [thinking_text],
+        })
+        if self.debug:
+            print(f"  -> thinking: {thinking_text[:100]}...")
+
+    def _handle_tool_use_block(
+        self, block: Any, assistant_content: List[Dict[str, Any]], tool_uses: List[Dict[str, Any]], tools: ToolExecutor
+    ) -> None:
+        tool_name = block.name
+        tool_input = block.input
+        tool_id = block.id
+
+        assistant_content.append({
+            "type": "tool_use",
+            "id": tool_id,
+            "name": tool_name,
+            "input": tool_input,
+        })
+        tool_uses.append({
+            "id": tool_id,
+            "name": tool_name,
+            "input": tool_input,
+        })
 
-        Devuelve (acciones_ejecutadas, tokens_in, tokens_out).
-        Mantiene el historial de mensajes en tools.engine.anthropic_messages.
-        """
-        actions: List[Action] = []
-        tokens_in_total = 0
-        tokens_out_total = 0
+        if self.debug:
+            print(f"  -> tool_use: {tool_name}({short_json(tool_input)}) id={tool_id[:20]}...")
 
-        system_prompt = _load_system_prompt()
-        tools_def = _to_anthropic_tools(_load_tools_config())
-        user_content = self._format_observation_message(obs)
+    def _start_turn(self, obs: Observation, tools: ToolExecutor) -> List[Dict[str, Any]]:
+        """Añade la observación al historial de mensajes del engine y lo devuelve."""
+        user_content = format_observation_message(obs)
 
         # Obtener historial de mensajes previos
         messages: List[Dict[str, Any]] = getattr(tools.engine, "anthropic_messages", [])
@@ -212,131 +229,225 @@ class AnthropicResponder:
             print(f"Mensajes en historial: {len(messages)}")
             try:
                 print("Observation actual:")
-                print(json.dumps(obs, indent=2, ensure_ascii=False))
+                print(orjson.dumps(obs, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS).decode())
             except TypeError:
                 print(f"Observation (raw): {obs}")
+        return messages
 
-        turn_finished = False
+    def _request_kwargs(
+        self, system_prompt: str, tools_def: List[Dict[str, Any]], messages: List[Dict[str, Any]]
+    ) -> Dict[str, Any]:
+        """
+        Parámetros de una llamada a la Messages API (sin los betas), con prompt caching
+        en tools y system. El historial se marca con _cache_breakpoint al enviarlo.
+        """
+        request_kwargs: Dict[str, Any] = {
+            "model": self.model,
+            "max_tokens": 20000,
+            "system": [{"type": "text", "text": system_prompt, "cache_control": _EPHEMERAL}],
+            "messages": messages,
+            "tools": tools_def,
+            "tool_choice": {"type": "auto", "disable_parallel_tool_use": False },
+        }
 
-        while not turn_finished:
-            # Construir request
-            request_kwargs: Dict[str, Any] = {
-                "model": self.model,
-                "max_tokens": 20000,
-                "system": system_prompt,
-                "messages": messages,
-                "tools": tools_def,
-                "tool_choice": {"type": "auto", "disable_parallel_tool_use": False },
+        # Añadir thinking si está configurado
+        if self.reasoning_effort:
+            budget = self._thinking_budgets.get(self.reasoning_effort, 16000)
+            request_kwargs["thinking"] = {
+                "type": "enabled",
+                "budget_tokens": budget,
             }
+        return request_kwargs
+
+    def _run_tool_use(
+        self, tu: Dict[str, Any], dispatch: ToolDispatch, actions: List[Action]
+    ) -> Dict[str, Any]:
+        """Ejecuta un tool_use en el simulador y devuelve su tool_result."""
+        res, action = execute_tool_call(dispatch, tu["name"], tu["input"], tu["id"])
 
-            # Añadir thinking si está configurado
-            if self.reasoning_effort:
-                budget = self._thinking_budgets.get(self.reasoning_effort, 16000)
-                request_kwargs["thinking"] = {
-                    "type": "enabled",
-                    "budget_tokens": budget,
-                }
-
-            # Usar el endpoint beta con interleaved-thinking
-            response = self.client.beta.messages.create(
-                betas=["interleaved-thinking-2025-05-14"],
-                **request_kwargs
+        if action:
+            actions.append(action)
+
+        if self.debug:
+            print(f"  -> tool ejecutada: {tu['name']}")
+
+        # Formato de tool_result para Anthropic
+        tool_result = {
+            "type": "tool_result",
+            "tool_use_id": tu["id"],
+            "content": tool_result_json(res),
+        }
+        return tool_result
+
+    def _queue_tool_use(
+        self,
+        tu: Dict[str, Any],
+        dispatch: ToolDispatch,
+        actions: List[Action],
+        tool_results: List[Dict[str, Any]],
+        end_turn_uses: List[Tuple[int, Dict[str, Any]]],
+    ) -> None:
+        """
+        Ejecuta un tool_use salvo end_turn, que se aplaza (guardando su posición en
+        tool_results) para que el resto de tools de la respuesta se apliquen antes.
+        """
+        if tu["name"] == "end_turn":
+            end_turn_uses.append((len(tool_results), tu))
+            tool_results.append({})
+        else:
+            tool_results.append(self._run_tool_use(tu, dispatch, actions))
+
+    def _run_end_turn(
+        self,
+        end_turn_uses: List[Tuple[int, Dict[str, Any]]],
+        tool_results: List[Dict[str, Any]],
+        dispatch: ToolDispatch,
+        actions: List[Action],
+    ) -> bool:
+        """
+        Ejecuta una sola vez los end_turn aplazados y rellena sus tool_result.
+        Devuelve True si la respuesta pedía terminar el turno.
+        """
+        if not end_turn_uses:
+            return False
+        result = self._run_tool_use(end_turn_uses[0][1], dispatch, actions)
+        for slot, tu in end_turn_uses:
+            tool_results[slot] = {**result, "tool_use_id": tu["id"]}
+        return True
+
+    def _finish_response(
+        self,
+        assistant_content: List[Dict[str, Any]],
+        tool_results: List[Dict[str, Any]],
+        messages: List[Dict[str, Any]],
+        tools: ToolExecutor,
+        actions: List[Action],
+    ) -> None:
+        """Añade al historial el mensaje del asistente y los tool_result (o fuerza end_turn si no hubo tools)."""
+        # Añadir respuesta del asistente al historial
+        if assistant_content:
+            messages.append({"role": "assistant", "content": assistant_content})
+
+        # Si no hay tool_uses, forzamos end_turn
+        if not tool_results:
+            if self.debug:
+                print("  -> Sin tool_use, forzando end_turn")
+            tools.end_turn()
+            actions.append(END_TURN_ACTION)
+            return
+
+        # Añadir resultados de tools como mensaje de usuario (siempre, incluso si el turno terminó)
+        messages.append({"role": "user", "content": tool_results})
+
+    def _handle_response(
+        self,
+        response: Any,
+        messages: List[Dict[str, Any]],
+        dispatch: ToolDispatch,
+        tools: ToolExecutor,
+        actions: List[Action],
+    ) -> bool:
+        """
+        Procesa una respuesta completa del modelo: ejecuta sus tool_use y añade al historial
+        el mensaje del asistente y los tool_result. Devuelve True si el turno terminó.
+        """
+        assistant_content: List[Dict[str, Any]] = []
+        tool_uses: List[Dict[str, Any]] = []
+
+        block_handlers = self._block_handlers
+        for block in response.content:
+            handler = block_handlers.get(block.type)
+            if handler is not None:
+                handler(block, assistant_content, tool_uses, tools)
+
+        # Ejecutar tools y preparar resultados (end_turn siempre el último)
+        tool_results: List[Dict[str, Any]] = []
+        end_turn_uses: List[Tuple[int, Dict[str, Any]]] = []
+        for tu in tool_uses:
+            self._queue_tool_use(tu, dispatch, actions, tool_results, end_turn_uses)
+        turn_finished = self._run_end_turn(end_turn_uses, tool_results, dispatch, actions)
+
+        self._finish_response(assistant_content, tool_results, messages, tools, actions)
+        return turn_finished or not tool_uses
+
+    def _stream_response(
+        self,
+        request_kwargs: Dict[str, Any],
+        messages: List[Dict[str, Any]],
+        dispatch: ToolDispatch,
+        tools: ToolExecutor,
+        actions: List[Action],
+    ) -> Tuple[bool, Any]:
+        """
+        Igual que _handle_response pero en streaming: cada tool_use se ejecuta en cuanto
+        su bloque termina, mientras el modelo sigue generando el resto de la respuesta.
+        Las tools se ejecutan en orden y en este hilo (el simulador no es thread-safe),
+        salvo end_turn, que se aplica al final.
+        Devuelve (turno_terminado, usage).
+        """
+        assistant_content: List[Dict[str, Any]] = []
+        tool_uses: List[Dict[str, Any]] = []
+        tool_results: List[Dict[str, Any]] = []
+        end_turn_uses: List[Tuple[int, Dict[str, Any]]] = []
+
+        block_handlers = self._block_handlers
+        with _cache_breakpoint(messages), self.client.beta.messages.stream(betas=_BETAS, **request_kwargs) as stream:
+            for event in stream:
+                if event.type != "content_block_stop":
+                    continue
+                block = event.content_block
+                handler = block_handlers.get(block.type)
+                if handler is None:
+                    continue
+                handler(block, assistant_content, tool_uses, tools)
+                if block.type == "tool_use":
+                    self._queue_tool_use(tool_uses[-1], dispatch, actions, tool_results, end_turn_uses)
+            usage = stream.get_final_message().usage
+
+        # end_turn (si lo hay) se aplica cuando ya se han ejecutado todas las demás tools
+        turn_finished = self._run_end_turn(end_turn_uses, tool_results, dispatch, actions)
+        self._finish_response(assistant_content, tool_results, messages, tools, actions)
+        return turn_finished or not tool_uses, usage
+
+    def record_replayed_turn(self, obs: Observation, actions: List[Action], tools: ToolExecutor) -> None:
+        """Añade al historial un turno resuelto sin llamar a la API: la observación y las acciones aplicadas."""
+        messages = self._start_turn(obs, tools)
+        messages.append({"role": "assistant", "content": [{"type": "text", "text": replayed_turn_text(actions)}]})
+        tools.engine.anthropic_messages = messages
+
+    def decide(
+        self,
+        obs: Observation,
+        tools: ToolExecutor,
+        history: List[Observation] | None = None,
+    ) -> Tuple[List[Action], int, int]:
+        """
+        Ejecuta un bucle de tool-calling hasta que el modelo invoque end_turn.
+
+        Devuelve (acciones_ejecutadas, tokens_in, tokens_out).
+        Mantiene el historial de mensajes en tools.engine.anthropic_messages.
+        """
+        actions: List[Action] = []
+        tokens_in_total = 0
+        tokens_out_total = 0
+
+        system_prompt = load_system_prompt()
+        tools_def = _get_cached_tools_def()
+        messages = self._start_turn(obs, tools)
+
+        # Métodos del ToolExecutor de este turno, resueltos una sola vez
+        dispatch = build_tool_dispatch(tools)
+        turn_finished = False
+
+        while not turn_finished:
+            # Endpoint beta con interleaved-thinking, en streaming
+            turn_finished, usage = self._stream_response(
+                self._request_kwargs(system_prompt, tools_def, messages), messages, dispatch, tools, actions
             )
 
-            # Acumular tokens
-            if hasattr(response, "usage"):
-                tokens_in_total += int(getattr(response.usage, "input_tokens", 0))
-                tokens_out_total += int(getattr(response.usage, "output_tokens", 0))
-
-            # Procesar el contenido de la respuesta
-            assistant_content: List[Dict[str, Any]] = []
-            tool_uses: List[Dict[str, Any]] = []
-
-            for block in response.content:
-                block_type = getattr(block, "type", "")
-
-                if block_type == "text":
-                    text = getattr(block, "text", "")
-                    assistant_content.append({"type": "text", "text": text})
-                    if self.debug:
-                        print(f"  -> texto: {text[:100]}...")
-
-                elif block_type == "thinking":
-                    thinking_text = getattr(block, "thinking", "")
-                    thinking_signature = getattr(block, "signature", "")
-                    # Incluir en el historial para que Anthropic pueda validar
-                    assistant_content.append({
-                        "type": "thinking",
-                        "thinking": thinking_text,
-                        "signature": thinking_signature,
-                    })
-                    # Registrar en la traza de razonamiento (sin guardar el signature/id, sin truncar)
-                    tools.engine.agent_actions_trace.append({
-                        "type": "reasoning",
-                        "summary": [thinking_text],
-                    })
-                    if self.debug:
-                        print(f"  -> thinking: {thinking_text[:100]}...")
-
-                elif block_type == "tool_use":
-                    tool_name = getattr(block, "name", "")
-                    tool_input = getattr(block, "input", {})
-                    tool_id = getattr(block, "id", "")
-
-                    assistant_content.append({
-                        "type": "tool_use",
-                        "id": tool_id,
-                        "name": tool_name,
-                        "input": tool_input,
-                    })
-                    tool_uses.append({
-                        "id": tool_id,
-                        "name": tool_name,
-                        "input": tool_input,
-                    })
-
-                    if self.debug:
-                        print(f"  -> tool_use: {tool_name}({json.dumps(tool_input)[:50]}...) id={tool_id[:20]}...")
-
-            # Añadir respuesta del asistente al historial
-            if assistant_content:
-                messages.append({"role": "assistant", "content": assistant_content})
-
-            # Si no hay tool_uses, forzamos end_turn
-            if not tool_uses:
-                if self.debug:
-                    print("  -> Sin tool_use, forzando end_turn")
-                tools.end_turn()
-                actions.append({"type": "end_turn"})
-                turn_finished = True
-                break
-
-            # Ejecutar tools y preparar resultados
-            tool_results: List[Dict[str, Any]] = []
-            for tu in tool_uses:
-                res, action = self._execute_tool(tu["name"], tu["input"], tu["id"], tools)
-
-                if action:
-                    actions.append(action)
-
-                if tu["name"] == "end_turn":
-                    turn_finished = True
-
-                # Formato de tool_result para Anthropic
-                tool_results.append({
-                    "type": "tool_result",
-                    "tool_use_id": tu["id"],
-                    "content": json.dumps(res, ensure_ascii=False),
-                })
-
-                if self.debug:
-                    print(f"  -> tool ejecutada: {tu['name']}")
-
-            # Añadir resultados de tools como mensaje de usuario (siempre, incluso si el turno terminó)
-            messages.append({"role": "user", "content": tool_results})
-
-            if turn_finished:
-                break
+            # Acumular tokens (usage siempre viene en el mensaje final)
+            tokens_in_total += _input_tokens(usage)
+            tokens_out_total += usage.output_tokens
 
         # Guardar historial para el siguiente turno
         tools.engine.anthropic_messages = messages
@@ -346,3 +457,230 @@ class AnthropicResponder:
 
         return actions, tokens_in_total, tokens_out_total
 
+    def decide_batch(
+        self,
+        obs_list: List[Observation],
+        tools_list: List[ToolExecutor],
+        poll_interval: float = 5.0,
+        max_poll_interval: float = 60.0,
+    ) -> List[Tuple[List[Action], int, int]]:
+        """
+        Decide varios turnos independientes (uno por escenario/engine) con la
+        Message Batches API: más barata y con más throughput, pero no apta para
+        partidas interactivas por su latencia.
+
+        Cada ronda del bucle de tool-calling se envía como un único batch con una
+        petición por escenario aún activo; las tools se ejecutan en local entre
+        rondas, así que el resultado equivale a llamar a decide() en cada engine.
+        Devuelve una tupla (acciones, tokens_in, tokens_out) por escenario.
+        """
+        if len(obs_list) != len(tools_list):
+            raise ValueError("decide_batch necesita una observación por cada ToolExecutor")
+
+        system_prompt = load_system_prompt()
+        tools_def = _get_cached_tools_def()
+        histories = [self._start_turn(obs, tools) for obs, tools in zip(obs_list, tools_list)]
+        dispatches = [build_tool_dispatch(tools) for tools in tools_list]
+        results: List[Tuple[List[Action], int, int]] = [([], 0, 0) for _ in obs_list]
+        pending = set(range(len(obs_list)))
+
+        while pending:
+            with contextlib.ExitStack() as marks:
+                for i in pending:
+                    marks.enter_context(_cache_breakpoint(histories[i]))
+                batch = self.client.beta.messages.batches.create(
+                    betas=_BETAS,
+                    requests=[
+                        {
+                            "custom_id": f"turn-{i}",
+                            "params": self._request_kwargs(system_prompt, tools_def, histories[i]),
+                        }
+                        for i in sorted(pending)
+                    ],
+                )
+
+            # Esperar a que termine el batch (backoff exponencial entre consultas)
+            delay = poll_interval
+            while batch.processing_status != "ended":
+                time.sleep(delay)
+                delay = min(delay * 2, max_poll_interval)
+                batch = self.client.beta.messages.batches.retrieve(batch.id)
+            if self.debug:
+                print(f"[batch] {batch.id} terminado ({len(pending)} peticiones)")
+
+            for entry in self.client.beta.messages.batches.results(batch.id):
+                i = int(entry.custom_id.split("-", 1)[1])
+                if entry.result.type != "succeeded":
+                    raise RuntimeError(f"Petición {entry.custom_id} del batch {batch.id} fallida: {entry.result.type}")
+                response = entry.result.message
+                actions, tokens_in, tokens_out = results[i]
+                tokens_in += _input_tokens(response.usage)
+                tokens_out += response.usage.output_tokens
+                results[i] = (actions, tokens_in, tokens_out)
+                if self._handle_response(response, histories[i], dispatches[i], tools_list[i], actions):
+                    pending.discard(i)
+
+        for tools, messages in zip(tools_list, histories):
+            tools.engine.anthropic_messages = messages
+        return results
+
+
+class _TokenBucket:
+    """Cubo de tokens thread-safe: `capacity` unidades que se recargan a `rate` por segundo."""
+
+    def __init__(self, capacity: float, rate: float):
+        self.capacity = capacity
+        self.rate = rate
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, amount: float = 1.0) -> None:
+        """Bloquea hasta poder consumir `amount` unidades (nunca más que la capacidad)."""
+        amount = min(amount, self.capacity)
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= amount:
+                    self._tokens -= amount
+                    return
+                wait = (amount - self._tokens) / self.rate
+            time.sleep(wait)
+
+    def adjust(self, delta: float) -> None:
+        """Devuelve (delta > 0) o cobra (delta < 0) unidades; el saldo puede quedar en negativo."""
+        with self._lock:
+            self._tokens = min(self.capacity, self._tokens + delta)
+
+
+class _RateLimitedMessages:
+    """
+    Envuelve client.beta.messages: cada create()/stream() espera a los límites RPM/TPM
+    y reintenta los 429 respetando la cabecera Retry-After.
+
+    El TPM se descuenta por estimación (entrada serializada + `expected_output_tokens`) y
+    se concilia con el `usage` real al terminar la petición: cobrar `max_tokens` completo
+    bloquearía el pool en cuanto `max_tokens` supera la capacidad del cubo.
+    """
+
+    def __init__(
+        self,
+        messages: Any,
+        rpm: _TokenBucket,
+        tpm: _TokenBucket,
+        expected_output_tokens: int = 2000,
+        max_retries: int = 5,
+    ):
+        self._messages = messages
+        self._rpm = rpm
+        self._tpm = tpm
+        self._expected_output_tokens = expected_output_tokens
+        self._max_retries = max_retries
+
+    def _estimate_tokens(self, kwargs: Dict[str, Any]) -> int:
+        """Tokens estimados de la petición: ~4 bytes de JSON por token de entrada + salida esperada."""
+        size = sum(
+            len(orjson.dumps(kwargs.get(key) or [], default=str)) for key in ("system", "messages", "tools")
+        )
+        return size // _BYTES_PER_TOKEN + min(self._expected_output_tokens, kwargs.get("max_tokens", 0))
+
+    def _acquire(self, kwargs: Dict[str, Any]) -> int:
+        self._rpm.acquire()
+        estimate = self._estimate_tokens(kwargs)
+        self._tpm.acquire(estimate)
+        return estimate
+
+    def _settle(self, estimate: int, usage: Any) -> None:
+        """Ajusta el cubo TPM a lo que la petición consumió de verdad."""
+        self._tpm.adjust(estimate - (_input_tokens(usage) + usage.output_tokens))
+
+    def _settle_failed(self, estimate: int, stream: Any) -> None:
+        """Concilia un stream interrumpido con el usage parcial (o devuelve la estimación si no hay)."""
+        try:
+            usage = stream.current_message_snapshot.usage
+        except (AssertionError, AttributeError):
+            # El stream falló antes de recibir message_start: no hay usage que cobrar
+            self._tpm.adjust(estimate)
+            return
+        self._settle(estimate, usage)
+
+    def _backoff(self, exc: RateLimitError, attempt: int, estimate: int) -> None:
+        # Un 429 no consume tokens: se devuelve lo descontado antes de esperar
+        self._tpm.adjust(estimate)
+        if attempt == self._max_retries:
+            raise exc
+        retry_after = exc.response.headers.get("retry-after")
+        time.sleep(float(retry_after) if retry_after else 2.0 ** attempt)
+
+    def create(self, **kwargs: Any) -> Any:
+        for attempt in range(self._max_retries + 1):
+            estimate = self._acquire(kwargs)
+            try:
+                response = self._messages.create(**kwargs)
+            except RateLimitError as exc:
+                self._backoff(exc, attempt, estimate)
+                continue
+            self._settle(estimate, response.usage)
+            return response
+
+    @contextlib.contextmanager
+    def stream(self, **kwargs: Any) -> Iterator[Any]:
+        # La petición se envía al entrar en el context manager del SDK; el ExitStack
+        # le pasa a su __exit__ la excepción que esté propagándose desde el cuerpo
+        with contextlib.ExitStack() as stack:
+            for attempt in range(self._max_retries + 1):
+                estimate = self._acquire(kwargs)
+                try:
+                    stream = stack.enter_context(self._messages.stream(**kwargs))
+                    break
+                except RateLimitError as exc:
+                    self._backoff(exc, attempt, estimate)
+            try:
+                yield stream
+            except BaseException:
+                self._settle_failed(estimate, stream)
+                raise
+            self._settle(estimate, stream.get_final_message().usage)
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._messages, name)
+
+
+class AnthropicResponderPool:
+    """
+    Ejecuta decide() sobre varios escenarios independientes en paralelo (hilos),
+    con un único cliente de Anthropic compartido y limitado en peticiones (RPM)
+    y tokens (TPM) por minuto. Por defecto usa los límites conservadores del Tier 1.
+    `expected_output_tokens` es la salida que se descuenta del TPM antes de conocer el usage real.
+    """
+
+    def __init__(
+        self,
+        model: str,
+        reasoning_effort: str | None = None,
+        max_workers: int = 8,
+        requests_per_minute: int = 40,
+        tokens_per_minute: int = 16000,
+        expected_output_tokens: int = 2000,
+        debug: bool = False,
+    ):
+        self.max_workers = max_workers
+        # El responder no guarda estado de partida (vive en cada engine): se comparte entre hilos
+        self.responder = AnthropicResponder(model=model, reasoning_effort=reasoning_effort, debug=debug)
+        # Los 429 los gestiona el limitador (con Retry-After), no los reintentos del SDK
+        client = self.responder.client.with_options(max_retries=0)
+        rpm = _TokenBucket(requests_per_minute, requests_per_minute / 60.0)
+        tpm = _TokenBucket(tokens_per_minute, tokens_per_minute / 60.0)
+        messages = _RateLimitedMessages(client.beta.messages, rpm, tpm, expected_output_tokens)
+        self.responder.client = types.SimpleNamespace(beta=types.SimpleNamespace(messages=messages))
+
+    def decide_many(
+        self, obs_list: List[Observation], tools_list: List[ToolExecutor]
+    ) -> List[Tuple[List[Action], int, int]]:
+        """Un decide() por escenario; devuelve los resultados en el mismo orden."""
+        if len(obs_list) != len(tools_list):
+            raise ValueError("decide_many necesita una observación por cada ToolExecutor")
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            return list(pool.map(self.responder.decide, obs_list, tools_list))
@@ -0,0 +1,124 @@
+from __future__ import annotations
+
+import hashlib
+import os
+import pathlib
+import pickle
+import threading
+from typing import Any, Callable, Dict, List, Tuple
+
+import orjson
+import yaml
+
+from sim.types import Action
+
+try:
+    from yaml import CSafeLoader as _YamlLoader
+except ImportError:  # PyYAML sin libyaml
+    from yaml import SafeLoader as _YamlLoader
+
+
+# Caché de ficheros de configuración: ruta -> (firma del fichero, valor parseado).
+# La firma (mtime, tamaño, inodo) invalida la entrada si el fichero cambia en disco.
+_FileSignature = Tuple[int, int, int]
+_CONFIG_CACHE: Dict[pathlib.Path, Tuple[_FileSignature, Any]] = {}
+_CONFIG_LOCK = threading.Lock()
+
+
+def project_root() -> pathlib.Path:
+    return pathlib.Path(__file__).resolve().parents[2]
+
+
+def _cache_dir() -> pathlib.Path:
+    """Directorio de caché del usuario (no el temporal compartido: los pickles se cargan sin validar)."""
+    base = os.environ.get("XDG_CACHE_HOME") or pathlib.Path.home() / ".cache"
+    return pathlib.Path(base) / "santotobench"
+
+
+def _cached_read(path: pathlib.Path, loader: Callable[[pathlib.Path, _FileSignature], Any]) -> Any:
+    """
+    Carga `path` con `loader` solo si ha cambiado desde la última lectura.
+
+    El valor devuelto es compartido entre llamadas: debe tratarse como de solo lectura.
+    """
+    st = path.stat()
+    sig = (st.st_mtime_ns, st.st_size, st.st_ino)
+    with _CONFIG_LOCK:
+        cached = _CONFIG_CACHE.get(path)
+        if cached is not None and cached[0] == sig:
+            return cached[1]
+        value = loader(path, sig)
+        _CONFIG_CACHE[path] = (sig, value)
+        return value
+
+
+def _read_text(path: pathlib.Path, sig: _FileSignature) -> str:
+    return path.read_text(encoding="utf-8").strip()
+
+
+def _read_yaml(path: pathlib.Path, sig: _FileSignature) -> Any:
+    """
+    Parsea un YAML reutilizando, si sigue vigente, un pickle con el resultado
+    de una ejecución anterior (el pickle guarda la firma del YAML de origen).
+    """
+    digest = hashlib.sha1(str(path).encode()).hexdigest()[:12]
+    pkl_path = _cache_dir() / f"{path.stem}_{digest}.pkl"
+    try:
+        with open(pkl_path, "rb") as f:
+            pkl_sig, value = pickle.load(f)
+        if pkl_sig == sig:
+            return value
+    except (OSError, EOFError, ValueError, TypeError, pickle.UnpicklingError):
+        pass
+
+    value = yaml.load(path.read_text(encoding="utf-8"), Loader=_YamlLoader)
+    try:
+        pkl_path.parent.mkdir(mode=0o700, parents=True, exist_ok=True)
+        tmp_path = pkl_path.with_suffix(f".{os.getpid()}.tmp")
+        with open(tmp_path, "wb") as f:
+            pickle.dump((sig, value), f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, pkl_path)
+    except OSError:
+        pass  # Sin caché en disco (p. ej. HOME de solo lectura): se parsea en cada arranque
+    return value
+
+
+def load_system_prompt() -> str:
+    p = project_root() / "configs" / "prompts" / "system.txt"
+    return _cached_read(p, _read_text)
+
+
+def load_tools_config() -> Dict[str, Any]:
+    """tools.yml parseado (compartido, de solo lectura)."""
+    p = project_root() / "configs" / "tools.yml"
+    return _cached_read(p, _read_yaml)
+
+
+# Resultado de end_turn (y de cualquier tool que solo confirme): se serializa una vez
+_OK_RESULT = {"ok": True}
+_OK_RESULT_JSON = orjson.dumps(_OK_RESULT).decode()
+
+
+def tool_result_json(res: Any) -> str:
+    """
+    Resultado de una tool serializado para devolverlo al modelo.
+
+    orjson escribe UTF-8 sin escapar (como ensure_ascii=False); los workers en viaje usan claves int.
+    """
+    if res == _OK_RESULT:
+        return _OK_RESULT_JSON
+    return orjson.dumps(res, option=orjson.OPT_NON_STR_KEYS).decode()
+
+
+def replayed_turn_text(actions: List[Action]) -> str:
+    """
+    Mensaje del asistente para un turno resuelto sin llamar a la API (decisión reutilizada
+    de la caché semántica): deja en la conversación qué se hizo en ese turno.
+    """
+    return "Acciones aplicadas en este turno: " + orjson.dumps(actions, option=orjson.OPT_NON_STR_KEYS).decode()
+
+
+def short_json(obj: Any, limit: int = 50) -> str:
+    """JSON compacto de `obj` truncado a `limit` caracteres, para las trazas de debug."""
+    text = orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS).decode()
+    return text if len(text) <= limit else text[:limit] + "..."
@@ -1,13 +1,13 @@
 from __future__ import annotations
 
-import json
+import itertools
 import os
-import pathlib
+import random
+import sys
 import time
-from typing import Any, Dict, List, Tuple
+from typing import Any, ClassVar, Dict, List, Optional, Tuple
 
-import copy
-import yaml
+import orjson
 from dotenv import load_dotenv
 from google import genai
 from google.genai import types
@@ -15,28 +15,76 @@ from google.genai import errors as genai_errors
 
 from sim.engine import ToolExecutor
 from sim.types import Action, Observation
+from ..message_format import format_observation_message
+from ..tool_calls import END_TURN_ACTION, ToolDispatch, build_tool_dispatch, execute_tool_call
+from .common import load_system_prompt, load_tools_config, replayed_turn_text, short_json
 
-load_dotenv()
 
+# Definición de tools en formato Gemini: (tools_cfg de origen, tools transformadas).
+# load_tools_config devuelve el mismo objeto mientras tools.yml no cambie.
+_TOOLS_DEF_CACHE: Optional[Tuple[Dict[str, Any], List[types.Tool]]] = None
 
-def _project_root() -> pathlib.Path:
-    return pathlib.Path(__file__).resolve().parents[2]
 
+# Modelos que usan thinking_level en lugar de thinking_budget (toda la familia Gemini 3)
+_THINKING_LEVEL_PREFIX = "gemini-3"
 
-def _load_system_prompt() -> str:
-    p = _project_root() / "configs" / "prompts" / "system.txt"
-    return p.read_text(encoding="utf-8").strip()
+# Backoff ante 429 cuando la API no indica cuánto esperar (segundos)
+_BACKOFF_BASE = 8.0
+_BACKOFF_MAX = 60.0
+_BACKOFF_JITTER = 2.0
 
 
-def _load_tools_config() -> Dict[str, Any]:
-    p = _project_root() / "configs" / "tools.yml"
-    return yaml.safe_load(p.read_text(encoding="utf-8"))
+def _retry_delay(exc: genai_errors.APIError, attempt: int) -> float:
+    """
+    Segundos de espera antes del reintento `attempt` (1, 2, ...) de un 429.
+
+    Usa la cabecera Retry-After o el retryDelay de RetryInfo (p. ej. "33s") si la
+    API los envía; si no, backoff exponencial con jitter.
+    """
+    headers = getattr(getattr(exc, "response", None), "headers", None)
+    retry_after = headers.get("retry-after") if headers else None
+    if retry_after:
+        try:
+            return float(retry_after)
+        except ValueError:
+            pass  # Retry-After como fecha HTTP: se usa el backoff
+
+    error = exc.details.get("error") if isinstance(exc.details, dict) else None
+    for detail in (error.get("details") if isinstance(error, dict) else None) or []:
+        retry_delay = detail.get("retryDelay") if isinstance(detail, dict) else None
+        if retry_delay:
+            try:
+                return float(str(retry_delay).rstrip("s"))
+            except ValueError:
+                break
+
+    return min(_BACKOFF_MAX, _BACKOFF_BASE * 2 ** (attempt - 1)) + random.uniform(0, _BACKOFF_JITTER)
+
+
+# Campos de JSON Schema que Gemini NO soporta
+_UNSUPPORTED_KEYS = frozenset({
+    "additionalProperties",
+    "additional_properties",
+    "minimum",
+    "maximum",
+    "minItems",
+    "maxItems",
+    "minLength",
+    "maxLength",
+    "pattern",
+    "format",
+    "exclusiveMinimum",
+    "exclusiveMaximum",
+    "default",
+})
 
 
 def _clean_schema_for_gemini(schema: Any) -> Any:
     """
     Limpia un schema JSON para cumplir con la API de Gemini Function Calling.
     
+    Devuelve siempre dicts y listas nuevos (nunca modifica `schema`).
+
     Gemini solo admite un subconjunto de JSON Schema. Los campos soportados son:
     - type, properties, required, description, items, enum
     
@@ -48,27 +96,12 @@ def _clean_schema_for_gemini(schema: Any) -> Any:
     - pattern (regex)
     - format
     """
-    # Campos de JSON Schema que Gemini NO soporta
-    UNSUPPORTED_KEYS = {
-        "additionalProperties",
-        "additional_properties",
-        "minimum",
-        "maximum",
-        "minItems",
-        "maxItems",
-        "minLength",
-        "maxLength",
-        "pattern",
-        "format",
-        "exclusiveMinimum",
-        "exclusiveMaximum",
-        "default",
-    }
-    
     if isinstance(schema, dict):
+        if not schema:
+            return {}
         cleaned: Dict[str, Any] = {}
         for k, v in schema.items():
-            if k in UNSUPPORTED_KEYS:
+            if k in _UNSUPPORTED_KEYS:
                 continue
             cleaned[k] = _clean_schema_for_gemini(v)
         return cleaned
@@ -83,14 +116,17 @@ def _to_gemini_tools(tools_cfg: Dict[str, Any]) -> List[types.Tool]:
 
     - Convierte cada tool en FunctionDeclaration
     - Limpia campos de JSON Schema no soportados por Gemini
+
+    _clean_schema_for_gemini construye dicts y listas nuevos, así que el
+    tools_cfg compartido no se modifica y no hace falta copiarlo antes.
     """
     function_declarations = []
     for t in tools_cfg.get("tools", []):
         params = t.get("parameters", {"type": "object", "properties": {}})
-        params = _clean_schema_for_gemini(copy.deepcopy(params))
+        params = _clean_schema_for_gemini(params)
         function_declarations.append(
             types.FunctionDeclaration(
-                name=t["name"],
+                name=sys.intern(t["name"]),
                 description=t.get("description", ""),
                 parameters=params,
             )
@@ -98,6 +134,21 @@ def _to_gemini_tools(tools_cfg: Dict[str, Any]) -> List[types.Tool]:
     return [types.Tool(function_declarations=function_declarations)]
 
 
+def _get_cached_tools_def() -> List[types.Tool]:
+    """
+    Tools en formato Gemini, transformadas una sola vez mientras tools.yml no cambie.
+
+    La lista es compartida entre turnos y responders: de solo lectura.
+    """
+    global _TOOLS_DEF_CACHE
+    tools_cfg = load_tools_config()
+    cached = _TOOLS_DEF_CACHE
+    if cached is None or cached[0] is not tools_cfg:
+        cached = (tools_cfg, _to_gemini_tools(tools_cfg))
+        _TOOLS_DEF_CACHE = cached
+    return cached[1]
+
+
 class GeminiResponder:
     """
     Adaptador de la API de Google Gemini al simulador.
@@ -105,11 +156,29 @@ class GeminiResponder:
     Soporta:
     - Tool calling con formato específico de Gemini
     - Thinking (razonamiento):
-      - Gemini 3 (gemini-3-pro-preview): usa thinking_level (LOW/HIGH)
+      - Gemini 3 (gemini-3-*): usa thinking_level (LOW/HIGH)
       - Otros modelos: usa thinking_budget (4096/8192/16384 tokens)
     - Historial de mensajes entre turnos con thought signatures
     """
 
+    __slots__ = (
+        "model",
+        "reasoning_effort",
+        "temperature",
+        "debug",
+        "client",
+        "_thinking_levels",
+        "_thinking_budgets",
+        "_call_counter",
+        "_thinking_config",
+        "_generate_config_cache",
+    )
+
+    # Máximo de mensajes del historial que se envían en cada request (None = todos).
+    # Se descartan turnos completos, del más antiguo al más reciente; el turno actual
+    # se envía siempre entero. El historial guardado en el engine no se recorta.
+    MAX_HISTORY: ClassVar[Optional[int]] = None
+
     def __init__(
         self,
         model: str,
@@ -123,6 +192,10 @@ class GeminiResponder:
         self.debug = debug
 
         api_key = os.getenv("GEMINI_API_KEY")
+        if not api_key:
+            # Solo se busca el .env si la clave no viene ya del entorno
+            load_dotenv()
+            api_key = os.getenv("GEMINI_API_KEY")
         if not api_key:
             raise RuntimeError("GEMINI_API_KEY no está configurada")
 
@@ -143,110 +216,112 @@ class GeminiResponder:
             "high": 24000,
         }
 
-        # Modelos que usan thinking_level en lugar de thinking_budget
-        self._models_with_thinking_level = {"gemini-3-pro-preview"}
-
-    def _format_observation_message(self, o: Observation) -> str:
-        """Formatea una observación como mensaje de usuario."""
-        time_str = o.get("time", "")
-        lts = o.get("last_turn_summary", {}) or {}
-        queue_len = int(lts.get("queue_end") or 0)
-        dropped_from_queue = int(lts.get("dropped_from_queue") or 0)
-        info_messages = lts.get("messages", []) or []
-        orders_served = lts.get("orders_served", []) or []
-        unserved_orders = lts.get("unserved_orders", []) or []
-
-        lines: List[str] = []
-        lines.append(f"Hora: {time_str}")
-        lines.append("")
-        lines.append(f"Hay {queue_len} personas esperando para pedir en la cola del puesto.")
-
-        for msg in info_messages:
-            lines.append("")
-            lines.append(msg)
-        if not info_messages and dropped_from_queue > 0:
-            lines.append("")
-            lines.append(
-                f"{dropped_from_queue} persona{'s' if dropped_from_queue != 1 else ''} se han ido de la cola porque llevaban más de media hora esperando."
-            )
+        # Contador para los call_id de las tools (Gemini no asigna ids a las llamadas)
+        self._call_counter = itertools.count()
+
+        # La configuración de thinking solo depende del modelo y del reasoning_effort
+        self._thinking_config = self._build_thinking_config()
 
-        if orders_served:
-            lines.append("")
-            lines.append("Pedidos servidos en los últimos 15 minutos:")
-            for i, order in enumerate(orders_served, 1):
-                items: Dict[str, Any] = {}
-                if isinstance(order, dict):
-                    items = order.get("items", order)
-                parts = [f"{int(qty)} {prod}" for prod, qty in items.items()]
-                lines.append(f"- Pedido {i}: " + ", ".join(parts))
-        else:
-            lines.append("")
-            lines.append("En los últimos 15 minutos no se ha servido ningún pedido.")
-
-        if unserved_orders:
-            lines.append("")
-            lines.append("Pedidos que no han podido ser atendidos por capacidad:")
-            for i, order in enumerate(unserved_orders, 1):
-                items: Dict[str, Any] = {}
-                if isinstance(order, dict):
-                    items = order.get("items", order)
-                parts = [f"{int(qty)} {prod}" for prod, qty in items.items()]
-                lines.append(f"- Pedido {i}: " + ", ".join(parts))
-        else:
-            lines.append("")
-            lines.append("No ha quedado ningún pedido sin atender por capacidad.")
-
-        return "\n".join(lines)
+        # Última configuración de generación: (clave de sus entradas, tools_def, config)
+        self._generate_config_cache: Optional[
+            Tuple[Tuple[Any, ...], List[types.Tool], types.GenerateContentConfig]
+        ] = None
+
+    def _build_thinking_config(self) -> Optional[types.ThinkingConfig]:
+        """Configuración de thinking si está habilitado (None si no hay reasoning_effort)."""
+        if self.reasoning_effort:
+            # Gemini 3 usa thinking_level (LOW/HIGH)
+            # Otros modelos usan thinking_budget (número de tokens)
+            if self.model.startswith(_THINKING_LEVEL_PREFIX):
+                level = self._thinking_levels.get(self.reasoning_effort, "HIGH")
+                return types.ThinkingConfig(
+                    thinking_level=level,
+                    include_thoughts=True,
+                )
+            else:
+                budget = self._thinking_budgets.get(self.reasoning_effort, 8192)
+                return types.ThinkingConfig(
+                    thinking_budget=budget,
+                    include_thoughts=True,
+                )
+        return None
+
+    def _get_generate_config(
+        self, system_prompt: str, tools_def: List[types.Tool]
+    ) -> types.GenerateContentConfig:
+        """
+        Configuración de generación, construida solo cuando cambian sus entradas.
+
+        Depende de la temperatura, de la configuración de thinking (fijada en
+        __init__) y del system prompt / tools cacheados, que son los mismos
+        objetos mientras no cambien en disco.
+        """
+        key = (self.temperature, system_prompt)
+        cached = self._generate_config_cache
+        if cached is not None and cached[1] is tools_def and cached[0] == key:
+            return cached[2]
+
+        # Configuración de generación
+        generate_config = types.GenerateContentConfig(
+            temperature=self.temperature,
+            thinking_config=self._thinking_config,
+            tools=tools_def,
+            tool_config=types.ToolConfig(
+                function_calling_config=types.FunctionCallingConfig(mode="AUTO")
+            ),
+            system_instruction=system_prompt
+        )
+
+        self._generate_config_cache = (key, tools_def, generate_config)
+        return generate_config
 
     def _execute_tool(
-        self, name: str, args: Dict[str, Any], tools: ToolExecutor
+        self, name: str, args: Dict[str, Any], dispatch: ToolDispatch
     ) -> Tuple[Dict[str, Any], Action | None]:
         """Ejecuta una tool en el simulador y devuelve (resultado, acción)."""
         # Generamos un call_id simple para compatibilidad con el engine
-        call_id = f"gemini_{name}_{id(args)}"
-
-        if name == "get_status":
-            res = tools.get_status(call_id=call_id, arguments={})
-            return res, {"type": "get_status"}
-        elif name == "get_prices":
-            res = tools.get_prices(call_id=call_id, arguments={})
-            return res, {"type": "get_prices"}
-        elif name == "set_prices":
-            prices_list = args.get("prices") or []
-            prices = {}
-            for it in prices_list:
-                product = it.get("product")
-                price = it.get("price")
-                if product and price is not None:
-                    prices[product] = float(price)
-            res = tools.set_prices(prices, call_id=call_id, arguments=args)
-            return res, {"type": "set_prices", "prices": prices}
-        elif name == "place_order":
-            items_list = args.get("items") or []
-            quantities = {}
-            for it in items_list:
-                ingredient = it.get("ingredient")
-                quantity = it.get("quantity")
-                if ingredient and quantity is not None:
-                    quantities[ingredient] = int(float(quantity))
-            workers = [int(w) for w in (args.get("workers") or []) if w is not None]
-            res = tools.place_order(quantities, workers, call_id=call_id, arguments=args)
-            return res, {"type": "place_order", "quantities": quantities, "workers": workers}
-        elif name == "assign_workers":
-            assignments_list = args.get("assignments") or []
-            assignments = []
-            for it in assignments_list:
-                emp_id = it.get("employee_id")
-                task = it.get("task")
-                if emp_id is not None and task is not None:
-                    assignments.append({"employee_id": int(emp_id), "task": task})
-            res = tools.assign_workers(assignments, call_id=call_id, arguments=args)
-            return res, {"type": "assign_workers", "assignments": assignments}
-        elif name == "end_turn":
-            res = tools.end_turn(call_id=call_id, arguments={})
-            return res, {"type": "end_turn"}
-        else:
-            return {"ok": False, "reason": f"Tool desconocida: {name}"}, None
+        # (contador monótono: id(args) se puede reciclar entre turnos)
+        call_id = f"gemini_{name}_{next(self._call_counter)}"
+        return execute_tool_call(dispatch, name, args, call_id)
+
+    def _run_function_call(
+        self, fc: Dict[str, Any], dispatch: ToolDispatch, actions: List[Action]
+    ) -> types.Part:
+        """Ejecuta una function_call y devuelve la FunctionResponse para el historial."""
+        res, action = self._execute_tool(fc["name"], fc["args"], dispatch)
+        if action:
+            actions.append(action)
+        if self.debug:
+            print(f"  -> tool ejecutada: {fc['name']}")
+        return types.Part.from_function_response(name=fc["name"], response=res)
+
+    def _history_window_start(self, messages: List[types.Content]) -> int:
+        """
+        Índice del primer mensaje a enviar según MAX_HISTORY.
+
+        Solo se corta al inicio de un turno (mensaje de usuario con la observación,
+        no con function responses), para no separar llamadas de sus respuestas.
+        """
+        limit = self.MAX_HISTORY
+        if limit is None or len(messages) <= limit:
+            return 0
+        # El último mensaje es la observación del turno actual
+        start = len(messages) - 1
+        for i in range(start - 1, len(messages) - limit - 1, -1):
+            msg = messages[i]
+            if msg.role == "user" and msg.parts and msg.parts[0].function_response is None:
+                start = i
+        return start
+
+    def record_replayed_turn(self, obs: Observation, actions: List[Action], tools: ToolExecutor) -> None:
+        """Añade al historial un turno resuelto sin llamar a la API: la observación y las acciones aplicadas."""
+        messages: Optional[List[types.Content]] = getattr(tools.engine, "gemini_messages", None)
+        if messages is None:
+            messages = tools.engine.gemini_messages = []
+        messages.append(
+            types.Content(role="user", parts=[types.Part.from_text(text=format_observation_message(obs))])
+        )
+        messages.append(types.Content(role="model", parts=[types.Part.from_text(text=replayed_turn_text(actions))]))
 
     def decide(
         self,
@@ -265,43 +340,18 @@ class GeminiResponder:
         tokens_in_total = 0
         tokens_out_total = 0
 
-        system_prompt = _load_system_prompt()
-        tools_def = _to_gemini_tools(_load_tools_config())
-        user_content = self._format_observation_message(obs)
+        system_prompt = load_system_prompt()
+        tools_def = _get_cached_tools_def()
+        user_content = format_observation_message(obs)
 
-        # Obtener historial de mensajes previos
-        messages: List[types.Content] = getattr(tools.engine, "gemini_messages", [])
+        # Obtener historial de mensajes previos (se crea en el engine el primer turno
+        # y después se modifica en el sitio, sin reasignarlo al final)
+        messages: Optional[List[types.Content]] = getattr(tools.engine, "gemini_messages", None)
         if messages is None:
-            messages = []
-
-        # Construir configuración de thinking si está habilitado
-        thinking_config = None
-        if self.reasoning_effort:
-            # Gemini 3 usa thinking_level (LOW/HIGH)
-            # Otros modelos usan thinking_budget (número de tokens)
-            if self.model in self._models_with_thinking_level:
-                level = self._thinking_levels.get(self.reasoning_effort, "HIGH")
-                thinking_config = types.ThinkingConfig(
-                    thinking_level=level,
-                    include_thoughts=True,
-                )
-            else:
-                budget = self._thinking_budgets.get(self.reasoning_effort, 8192)
-                thinking_config = types.ThinkingConfig(
-                    thinking_budget=budget,
-                    include_thoughts=True,
-                )
+            messages = tools.engine.gemini_messages = []
 
-        # Configuración de generación
-        generate_config = types.GenerateContentConfig(
-            temperature=self.temperature,
-            thinking_config=thinking_config,
-            tools=tools_def,
-            tool_config=types.ToolConfig(
-                function_calling_config=types.FunctionCallingConfig(mode="AUTO")
-            ),
-            system_instruction=system_prompt
-        )
+        generate_config = self._get_generate_config(system_prompt, tools_def)
+        dispatch = build_tool_dispatch(tools)
 
         # Añadir el nuevo mensaje de usuario
         messages.append(
@@ -316,7 +366,7 @@ class GeminiResponder:
             print(f"Mensajes en historial: {len(messages)}")
             try:
                 print("Observation actual:")
-                print(json.dumps(obs, indent=2, ensure_ascii=False))
+                print(orjson.dumps(obs, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS).decode())
             except TypeError:
                 print(f"Observation (raw): {obs}")
 
@@ -325,15 +375,19 @@ class GeminiResponder:
         max_retries = 3
         retry_count = 0
 
-        while not turn_finished:
-            # Construir request
-            # System instruction solo se envía una vez y Gemini lo mantiene
-            request_kwargs: Dict[str, Any] = {
-                "model": self.model,
-                "contents": messages,
-                "config": generate_config,
-            }
+        # Construir request una sola vez: `messages` se extiende en el sitio, así que
+        # cada iteración envía el historial actualizado sin rehacer los argumentos
+        # System instruction solo se envía una vez y Gemini lo mantiene
+        window_start = self._history_window_start(messages)
+        request_kwargs: Dict[str, Any] = {
+            "model": self.model,
+            "contents": messages,
+            "config": generate_config,
+        }
 
+        while not turn_finished:
+            if window_start:
+                request_kwargs["contents"] = messages[window_start:]
             try:
                 response = self.client.models.generate_content(**request_kwargs)
             except genai_errors.ClientError as exc:
@@ -342,8 +396,9 @@ class GeminiResponder:
                 print(f"\n⚠️  Gemini error {status_code}: {exc}")
                 if status_code == 429 and retry_count < max_retries:
                     retry_count += 1
-                    print(f"    Reintentando en 65s ({retry_count}/{max_retries})...")
-                    time.sleep(65)
+                    delay = _retry_delay(exc, retry_count)
+                    print(f"    Reintentando en {delay:.0f}s ({retry_count}/{max_retries})...")
+                    time.sleep(delay)
                     continue
                 print(f"    No se reintentará. Propagando error.")
                 raise
@@ -399,9 +454,14 @@ class GeminiResponder:
             function_calls: List[Dict[str, Any]] = []
 
             for part in candidate_content.parts:
+                # Una sola lectura por campo (sin hasattr, que atrapa AttributeError)
+                thought = getattr(part, "thought", None)
+                fc = getattr(part, "function_call", None)
+                text = getattr(part, "text", None)
+
                 # Es un pensamiento (thought)
-                if hasattr(part, "thought") and part.thought:
-                    thought_text = getattr(part, "text", "") or ""
+                if thought:
+                    thought_text = text or ""
                     # Guardar en traza de razonamiento (sin truncar)
                     tools.engine.agent_actions_trace.append({
                         "type": "reasoning",
@@ -413,23 +473,27 @@ class GeminiResponder:
                         print(f"  -> thought: {thought_text[:100]}...")
 
                 # Es una llamada a función
-                elif hasattr(part, "function_call") and part.function_call:
-                    fc = part.function_call
-                    fc_name = getattr(fc, "name", "") or ""
-                    fc_args = dict(fc.args) if hasattr(fc, "args") and fc.args else {}
+                elif fc:
+                    # Nombre internado: coincide por identidad con los de tools.yml y
+                    # con las claves de la tabla de dispatch
+                    fc_name = sys.intern(getattr(fc, "name", "") or "")
+                    # google-genai ya entrega args como dict: se usa sin copiarlo
+                    fc_args = fc.args
+                    if not isinstance(fc_args, dict):
+                        fc_args = dict(fc_args) if fc_args else {}
                     function_calls.append({
                         "name": fc_name,
                         "args": fc_args,
                     })
                     assistant_parts.append(part)
                     if self.debug:
-                        print(f"  -> function_call: {fc_name}({json.dumps(fc_args)[:50]}...)")
+                        print(f"  -> function_call: {fc_name}({short_json(fc_args)})")
 
                 # Es texto normal
-                elif hasattr(part, "text") and part.text:
+                elif text:
                     assistant_parts.append(part)
                     if self.debug:
-                        print(f"  -> texto: {part.text[:100]}...")
+                        print(f"  -> texto: {text[:100]}...")
 
             # Añadir respuesta del asistente al historial
             if assistant_parts:
@@ -440,31 +504,29 @@ class GeminiResponder:
                 if self.debug:
                     print("  -> Sin function_call, forzando end_turn")
                 tools.end_turn()
-                actions.append({"type": "end_turn"})
+                actions.append(END_TURN_ACTION)
                 turn_finished = True
                 break
 
-            # Ejecutar tools y preparar resultados
-            function_response_parts: List[types.Part] = []
-            for fc in function_calls:
-                res, action = self._execute_tool(fc["name"], fc["args"], tools)
-
-                if action:
-                    actions.append(action)
-
+            # Ejecutar tools y preparar resultados.
+            # Se ejecutan en orden en este hilo (ToolExecutor modifica el estado del engine
+            # y no es thread-safe), pero end_turn se aplaza hasta que el resto de tools de la
+            # respuesta se hayan aplicado, y se ejecuta una sola vez aunque el modelo lo pida
+            # varias. Los resultados mantienen el orden de las llamadas.
+            function_response_parts: List[Optional[types.Part]] = [None] * len(function_calls)
+            end_turn_slots: List[int] = []
+            for i, fc in enumerate(function_calls):
                 if fc["name"] == "end_turn":
-                    turn_finished = True
-
-                # Crear FunctionResponse para Gemini
-                function_response_parts.append(
-                    types.Part.from_function_response(
-                        name=fc["name"],
-                        response=res,
-                    )
-                )
+                    end_turn_slots.append(i)
+                    continue
+                function_response_parts[i] = self._run_function_call(fc, dispatch, actions)
 
-                if self.debug:
-                    print(f"  -> tool ejecutada: {fc['name']}")
+            if end_turn_slots:
+                # Todas las llamadas a end_turn reciben la respuesta de la única ejecución
+                end_turn_part = self._run_function_call(function_calls[end_turn_slots[0]], dispatch, actions)
+                for i in end_turn_slots:
+                    function_response_parts[i] = end_turn_part
+                turn_finished = True
 
             # Añadir resultados de functions como mensaje de usuario
             if function_response_parts:
@@ -473,9 +535,6 @@ class GeminiResponder:
             if turn_finished:
                 break
 
-        # Guardar historial para el siguiente turno
-        tools.engine.gemini_messages = messages
-
         if self.debug:
             print(f"=== DEBUG Gemini: Fin del turno ===\n")
 
@@ -1,33 +1,26 @@
 from __future__ import annotations
 
-import json
 import os
-import pathlib
-from typing import Any, Dict, List, Tuple
+import threading
+from typing import Any, ClassVar, Dict, List, Optional, Tuple
 
-import yaml
+import orjson
 from dotenv import load_dotenv
 from openai import OpenAI
 
 from sim.engine import ToolExecutor
 from sim.types import Action, Observation
+from ..message_format import format_observation_message
+from ..tool_calls import END_TURN_ACTION, ZERO_ARG_TOOLS, ToolDispatch, build_tool_dispatch, execute_tool_call
+from .common import load_system_prompt, load_tools_config, replayed_turn_text, tool_result_json
 
 # Cargar variables de entorno desde .env si existe
 load_dotenv()
 
 
-def _project_root() -> pathlib.Path:
-    return pathlib.Path(__file__).resolve().parents[2]
-
-
-def _load_system_prompt() -> str:
-    p = _project_root() / "configs" / "prompts" / "system.txt"
-    return p.read_text(encoding="utf-8").strip()
-
-
-def _load_tools_config() -> Dict[str, Any]:
-    p = _project_root() / "configs" / "tools.yml"
-    return yaml.safe_load(p.read_text(encoding="utf-8"))
+# Definición de tools en formato OpenAI: (tools_cfg de origen, tools transformadas).
+# load_tools_config devuelve el mismo objeto mientras tools.yml no cambie.
+_TOOLS_DEF_CACHE: Optional[Tuple[Dict[str, Any], List[Dict[str, Any]]]] = None
 
 
 def _to_openai_tools(tools_cfg: Dict[str, Any]) -> List[Dict[str, Any]]:
@@ -45,84 +38,94 @@ def _to_openai_tools(tools_cfg: Dict[str, Any]) -> List[Dict[str, Any]]:
     return tools
 
 
+def _get_cached_tools_def() -> List[Dict[str, Any]]:
+    """
+    Tools en formato OpenAI, transformadas una sola vez mientras tools.yml no cambie.
+
+    La lista es compartida entre turnos y responders: de solo lectura.
+    """
+    global _TOOLS_DEF_CACHE
+    tools_cfg = load_tools_config()
+    cached = _TOOLS_DEF_CACHE
+    if cached is None or cached[0] is not tools_cfg:
+        cached = (tools_cfg, _to_openai_tools(tools_cfg))
+        _TOOLS_DEF_CACHE = cached
+    return cached[1]
+
+
 class OpenAIResponder:
+    # Un único cliente (y pool de conexiones HTTP keep-alive) por API key para todos los responders
+    _shared_clients: ClassVar[Dict[str, OpenAI]] = {}
+    _shared_clients_lock: ClassVar[threading.Lock] = threading.Lock()
+
+    @classmethod
+    def _get_client(cls) -> OpenAI:
+        api_key = os.getenv("OPENAI_API_KEY")
+        if not api_key:
+            raise RuntimeError("OPENAI_API_KEY no está configurada")
+        with cls._shared_clients_lock:
+            client = cls._shared_clients.get(api_key)
+            if client is None:
+                client = OpenAI(api_key=api_key)
+                cls._shared_clients[api_key] = client
+            return client
+
     def __init__(self, model: str, reasoning_effort: str | None = None, temperature: float = 0.2, debug: bool = False):
         self.model = model
         self.reasoning_effort = reasoning_effort
         self.temperature = temperature
         self.debug = debug
-        api_key = os.getenv("OPENAI_API_KEY")
-        if not api_key:
-            raise RuntimeError("OPENAI_API_KEY no está configurada")
-        self.client = OpenAI(api_key=api_key)
+        self.client = self._get_client()
+        # Campos fijos de cada petición (tools incluidas), construidos una vez por tools_def
+        self._request_base: Optional[Tuple[List[Dict[str, Any]], Dict[str, Any]]] = None
+
+    def _get_request_base(self, tools_def: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """Campos de responses.create que no cambian entre peticiones (de solo lectura)."""
+        cached = self._request_base
+        if cached is None or cached[0] is not tools_def:
+            base: Dict[str, Any] = {
+                "model": self.model,
+                "tools": tools_def,
+                "tool_choice": "required",
+                "store": True,
+            }
+            if self.reasoning_effort:
+                base["reasoning"] = {"effort": self.reasoning_effort, "summary": "detailed"}
+            cached = (tools_def, base)
+            self._request_base = cached
+        return cached[1]
+
+    def _run_function_call(
+        self, dispatch: ToolDispatch, name: str, args: Dict[str, Any], call_id: str, actions: List[Action]
+    ) -> Dict[str, Any]:
+        """Ejecuta una function_call en el simulador y devuelve su function_call_output."""
+        res, action = execute_tool_call(dispatch, name, args, call_id)
+        if action:
+            actions.append(action)
 
-    def _format_observation_message(self, o: Observation) -> str:
-        """Formatea una observación como mensaje de usuario.
+        if self.debug:
+            print(f"  -> function_call_output añadido para {name}")
 
-        Solo incluye:
-        - Número de personas en la cola al inicio del turno.
-        - Pedidos servidos en el turno anterior (si los hay).
-        - Pedidos que no se pudieron atender por falta de capacidad.
+        # Mensaje con el resultado para la siguiente petición
+        return {
+            "type": "function_call_output",
+            "call_id": call_id,
+            "output": tool_result_json(res),
+        }
+
+    def record_replayed_turn(self, obs: Observation, actions: List[Action], tools: ToolExecutor) -> None:
+        """
+        Registra un turno resuelto sin llamar a la API. previous_response_id no puede avanzar,
+        así que la observación y las acciones aplicadas se envían como entrada en la próxima petición.
         """
-        time_str = o.get("time", "")
-        lts = o.get("last_turn_summary", {}) or {}
-        # Aproximamos el tamaño de la cola al inicio del turno actual
-        # usando la cola al final del turno anterior.
-        queue_len = int(lts.get("queue_end", 0))
-        dropped_from_queue = int(lts.get("dropped_from_queue", 0))
-        info_messages = lts.get("messages", []) or []
-        orders_served = lts.get("orders_served", []) or []
-        unserved_orders = lts.get("unserved_orders", []) or []
-
-        lines: List[str] = []
-
-        # Hora del turno actual
-        lines.append(f"Hora: {time_str}")
-
-        # Número de personas en cola
-        lines.append("")
-        lines.append(f"Hay {queue_len} personas esperando para pedir en la cola del puesto.")
-
-        # Mensajes informativos del turno anterior (incluye abandonos de la cola)
-        for msg in info_messages:
-            lines.append("")
-            lines.append(msg)
-        if not info_messages and dropped_from_queue > 0:
-            lines.append("")
-            lines.append(
-                f"{dropped_from_queue} persona{'s' if dropped_from_queue != 1 else ''} se han ido de la cola porque llevaban más de media hora esperando."
-            )
-
-        # Pedidos servidos
-        if orders_served:
-            lines.append("")
-            lines.append("Pedidos servidos en los últimos 15 minutos:")
-            for i, order in enumerate(orders_served, 1):
-                # Estructura esperada: {"items": {producto: unidades, ...}}
-                items: Dict[str, Any] = {}
-                if isinstance(order, dict):
-                    items = order.get("items", order)
-                parts = [f"{int(qty)} {prod}" for prod, qty in items.items()]
-                lines.append(f"- Pedido {i}: " + ", ".join(parts))
-        else:
-            lines.append("")
-            lines.append("En los últimos 15 minutos no se ha servido ningún pedido.")
-
-        # Pedidos no atendidos por capacidad
-        if unserved_orders:
-            lines.append("")
-            lines.append("Pedidos que no han podido ser atendidos por capacidad:")
-            for i, order in enumerate(unserved_orders, 1):
-                items: Dict[str, Any] = {}
-                if isinstance(order, dict):
-                    items = order.get("items", order)
-                parts = [f"{int(qty)} {prod}" for prod, qty in items.items()]
-                lines.append(f"- Pedido {i}: " + ", ".join(parts))
-        else:
-            lines.append("")
-            lines.append("No ha quedado ningún pedido sin atender por capacidad.")
-
-        return "\n".join(lines)
+        engine = tools.engine
+        pending: List[Dict[str, Any]] = list(engine.pending_tool_outputs)
+        if not engine.previous_response_id and not pending:
+            pending.append({"role": "system", "content": load_system_prompt()})
+        pending.append({"role": "user", "content": format_observation_message(obs)})
+        pending.append({"role": "assistant", "content": replayed_turn_text(actions)})
+        # Lista nueva: la anterior puede estar guardada en una entrada de la caché
+        engine.pending_tool_outputs = pending
 
     def decide(self, obs: Observation, tools: ToolExecutor, history: List[Observation] | None = None) -> Tuple[List[Action], int, int]:
         """
@@ -134,21 +137,24 @@ class OpenAIResponder:
         tokens_in_total = 0
         tokens_out_total = 0
 
-        system_prompt = _load_system_prompt()
-        tools_def = _to_openai_tools(_load_tools_config())
+        request_base = self._get_request_base(_get_cached_tools_def())
+        engine = tools.engine
+        dispatch = build_tool_dispatch(tools)
 
-        user_content = self._format_observation_message(obs)
-        previous_response_id = getattr(tools.engine, "previous_response_id", None)
+        user_content = format_observation_message(obs)
+        previous_response_id = engine.previous_response_id
         pending_inputs: List[Dict[str, Any]] = []
-        pending_outputs = getattr(tools.engine, "pending_tool_outputs", []) or []
+        pending_outputs = engine.pending_tool_outputs
         if pending_outputs:
             pending_inputs.extend(pending_outputs)
-            tools.engine.pending_tool_outputs = []
+            engine.pending_tool_outputs = []
         if not previous_response_id and not pending_outputs:
-            pending_inputs.append({"role": "system", "content": system_prompt})
+            # El system prompt solo se envía (y se lee) al inicio de la conversación
+            pending_inputs.append({"role": "system", "content": load_system_prompt()})
         pending_inputs.append({"role": "user", "content": user_content})
 
         turn_finished = False
+        trace_append = engine.agent_actions_trace.append
 
         if self.debug:
             print(f"\n=== DEBUG: Turno {obs.get('turn', '?')} ===")
@@ -156,27 +162,19 @@ class OpenAIResponder:
             # Mostrar la Observation completa para depuración
             try:
                 print("Observation actual:")
-                print(json.dumps(obs, indent=2, ensure_ascii=False))
+                print(orjson.dumps(obs, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS).decode())
             except TypeError:
                 # Fallback por si algún valor no es serializable por JSON
                 print(f"Observation (raw): {obs}")
 
         while pending_inputs:
-            request_kwargs: Dict[str, Any] = {
-                "model": self.model,
-                "input": pending_inputs,
-                "tools": tools_def,
-                "tool_choice": "required",
-                "store": True,
-            }
-            if self.reasoning_effort:
-                request_kwargs["reasoning"] = {"effort": self.reasoning_effort, "summary": "detailed"}
+            request_kwargs: Dict[str, Any] = {**request_base, "input": pending_inputs}
             if previous_response_id:
                 request_kwargs["previous_response_id"] = previous_response_id
 
             response = self.client.responses.create(**request_kwargs)
             previous_response_id = getattr(response, "id", None)
-            tools.engine.previous_response_id = previous_response_id
+            engine.previous_response_id = previous_response_id
 
             # Acumular uso si viene
             if getattr(response, "usage", None):
@@ -186,24 +184,19 @@ class OpenAIResponder:
             # Procesar los items de la respuesta EN ORDEN (un solo loop para mantener el orden correcto)
             any_function_call = False
             tool_output_messages: List[Dict[str, Any]] = []
+            deferred_end_turns: List[Tuple[int, Dict[str, Any], str]] = []
 
             for item in getattr(response, "output", []) or []:
                 item_type = getattr(item, "type", "")
 
                 # Registrar razonamientos del modelo en la traza unificada
                 if item_type == "reasoning":
-                    rid = getattr(item, "id", "")
-                    raw_summary_list = getattr(item, "summary", None) or []
-                    texts: List[str] = []
-                    for s in raw_summary_list:
-                        text = getattr(s, "text", None)
-                        if text:
-                            texts.append(text)
+                    texts = [text for s in (getattr(item, "summary", None) or []) if (text := getattr(s, "text", None))]
                     if texts:
-                        tools.engine.agent_actions_trace.append(
+                        trace_append(
                             {
                                 "type": "reasoning",
-                                "id": rid,
+                                "id": getattr(item, "id", ""),
                                 "summary": texts,
                             }
                         )
@@ -215,75 +208,40 @@ class OpenAIResponder:
                     name = getattr(item, "name", "")
                     call_id = getattr(item, "call_id", "")
                     args_json = getattr(item, "arguments", "{}") or "{}"
-                    try:
-                        args = json.loads(args_json)
-                    except Exception:
+                    if name in ZERO_ARG_TOOLS:
                         args = {}
+                    else:
+                        try:
+                            args = orjson.loads(args_json)
+                        except Exception:
+                            args = {}
 
                     if self.debug:
                         print(f"  -> function_call: {name}({args_json[:50]}...) call_id={call_id[:20]}...")
 
-                    # Ejecutar tool real en el simulador
-                    if name == "get_status":
-                        res = tools.get_status(call_id=call_id, arguments={})
-                        actions.append({"type": "get_status"})
-                    elif name == "get_prices":
-                        res = tools.get_prices(call_id=call_id, arguments={})
-                        actions.append({"type": "get_prices"})
-                    elif name == "set_prices":
-                        # Formato: {"prices": [{"product": "sidra", "price": 5.0}, ...]}
-                        prices_list = args.get("prices") or []
-                        prices = {}
-                        for item in prices_list:
-                            product = item.get("product")
-                            price = item.get("price")
-                            if product and price is not None:
-                                prices[product] = float(price)
-                        res = tools.set_prices(prices, call_id=call_id, arguments=args)
-                        actions.append({"type": "set_prices", "prices": prices})
-                    elif name == "place_order":
-                        # Formato: {"items": [{"ingredient": "pan", "quantity": 50}, ...]}
-                        items_list = args.get("items") or []
-                        quantities = {}
-                        for item in items_list:
-                            ingredient = item.get("ingredient")
-                            quantity = item.get("quantity")
-                            if ingredient and quantity is not None:
-                                quantities[ingredient] = int(float(quantity))
-                        workers = [int(w) for w in (args.get("workers") or []) if w is not None]
-                        res = tools.place_order(quantities, workers, call_id=call_id, arguments=args)
-                        actions.append({"type": "place_order", "quantities": quantities, "workers": workers})
-                    elif name == "assign_workers":
-                        assignments_list = args.get("assignments") or []
-                        assignments = []
-                        for it in assignments_list:
-                            emp_id = it.get("employee_id")
-                            task = it.get("task")
-                            if emp_id is not None and task is not None:
-                                assignments.append({"employee_id": int(emp_id), "task": task})
-                        res = tools.assign_workers(assignments, call_id=call_id, arguments=args)
-                        actions.append({"type": "assign_workers", "assignments": assignments})
-                    elif name == "end_turn":
-                        res = tools.end_turn(call_id=call_id, arguments={})
-                        actions.append({"type": "end_turn"})
-                        turn_finished = True
-                    else:
-                        # Tool desconocida: devolver error al modelo
-                        res = {"ok": False, "reason": f"Tool desconocida: {name}"}
+                    # end_turn se aplaza (guardando su posición) hasta aplicar el resto de tools
+                    # de la respuesta. Se ejecutan en orden en este hilo: ToolExecutor modifica
+                    # el estado del engine y no es thread-safe.
+                    if name == "end_turn":
+                        deferred_end_turns.append((len(tool_output_messages), args, call_id))
+                        tool_output_messages.append({})
+                        continue
 
-                    # Preparar mensaje con el resultado para la siguiente petición
-                    tool_output_messages.append({
-                        "type": "function_call_output",
-                        "call_id": call_id,
-                        "output": json.dumps(res, ensure_ascii=False),
-                    })
-
-                    if self.debug:
-                        print(f"  -> function_call_output añadido para {name}")
+                    # Ejecutar tool real en el simulador
+                    tool_output_messages.append(self._run_function_call(dispatch, name, args, call_id, actions))
+
+            if deferred_end_turns:
+                # end_turn se ejecuta una sola vez aunque el modelo lo pida varias;
+                # cada function_call recibe la misma salida con su propio call_id
+                _, args, call_id = deferred_end_turns[0]
+                output = self._run_function_call(dispatch, "end_turn", args, call_id, actions)
+                for slot, _, call_id in deferred_end_turns:
+                    tool_output_messages[slot] = {**output, "call_id": call_id}
+                turn_finished = True
 
             if tool_output_messages:
                 if turn_finished:
-                    tools.engine.pending_tool_outputs = tool_output_messages
+                    engine.pending_tool_outputs = tool_output_messages
                     pending_inputs = []
                     break
                 pending_inputs = tool_output_messages
@@ -296,12 +254,12 @@ class OpenAIResponder:
 
             if not any_function_call:
                 # No hay function calls; forzamos end_turn para avanzar
-                res = tools.end_turn()
-                actions.append({"type": "end_turn"})
+                tools.end_turn()
+                actions.append(END_TURN_ACTION)
                 turn_finished = True
                 break
 
         if self.debug:
-            print(f"=== DEBUG: Fin del turno, previous_response_id={tools.engine.previous_response_id} ===\n")
+            print(f"=== DEBUG: Fin del turno, previous_response_id={engine.previous_response_id} ===\n")
 
         return actions, tokens_in_total, tokens_out_total
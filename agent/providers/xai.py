@@ -1,34 +1,27 @@
 from __future__ import annotations
 
-import json
 import os
-import pathlib
-from typing import Any, Dict, List, Tuple
+import threading
+from typing import Any, ClassVar, Dict, List, Optional, Tuple
 
-import yaml
+import orjson
 from dotenv import load_dotenv
 from xai_sdk import Client as XAIClient
-from xai_sdk.chat import system, user, tool, tool_result
+from xai_sdk.chat import assistant, system, user, tool, tool_result
 
 from sim.engine import ToolExecutor
 from sim.types import Action, Observation
+from ..message_format import format_observation_message
+from ..tool_calls import END_TURN_ACTION, ZERO_ARG_TOOLS, ToolDispatch, build_tool_dispatch, execute_tool_call
+from .common import load_system_prompt, load_tools_config, replayed_turn_text, short_json, tool_result_json
 
 # Cargar variables de entorno desde .env si existe
 load_dotenv()
 
 
-def _project_root() -> pathlib.Path:
-    return pathlib.Path(__file__).resolve().parents[2]
-
-
-def _load_system_prompt() -> str:
-    p = _project_root() / "configs" / "prompts" / "system.txt"
-    return p.read_text(encoding="utf-8").strip()
-
-
-def _load_tools_config() -> Dict[str, Any]:
-    p = _project_root() / "configs" / "tools.yml"
-    return yaml.safe_load(p.read_text(encoding="utf-8"))
+# Definición de tools en formato xAI: (tools_cfg de origen, tools transformadas).
+# load_tools_config devuelve el mismo objeto mientras tools.yml no cambie.
+_TOOLS_DEF_CACHE: Optional[Tuple[Dict[str, Any], List]] = None
 
 
 def _to_xai_tools(tools_cfg: Dict[str, Any]) -> List:
@@ -47,6 +40,44 @@ def _to_xai_tools(tools_cfg: Dict[str, Any]) -> List:
     return tools_list
 
 
+def _get_cached_tools_def() -> List:
+    """
+    Tools en formato xAI, transformadas una sola vez mientras tools.yml no cambie.
+
+    La lista es compartida entre turnos y responders: de solo lectura.
+    """
+    global _TOOLS_DEF_CACHE
+    tools_cfg = load_tools_config()
+    cached = _TOOLS_DEF_CACHE
+    if cached is None or cached[0] is not tools_cfg:
+        cached = (tools_cfg, _to_xai_tools(tools_cfg))
+        _TOOLS_DEF_CACHE = cached
+    return cached[1]
+
+
+def _tool_call_fields(tc: Any) -> Tuple[str, Any, Any]:
+    """
+    (name, arguments, id) de un tool_call con una forma distinta de la habitual
+    del SDK (sin .function o .id, o un dict).
+    """
+    function_obj = getattr(tc, "function", None)
+
+    if function_obj is not None:
+        name = getattr(function_obj, "name", "") or ""
+        args_json = getattr(function_obj, "arguments", "{}") or "{}"
+    elif isinstance(tc, dict):
+        # Fallback defensivo por si en algún momento la SDK devolviera dicts
+        func = tc.get("function", {}) or {}
+        name = func.get("name") or tc.get("name", "") or ""
+        args_json = func.get("arguments") or tc.get("arguments", "{}") or "{}"
+    else:
+        name = ""
+        args_json = "{}"
+
+    call_id = getattr(tc, "id", "") if hasattr(tc, "id") else tc.get("id", "") if isinstance(tc, dict) else ""
+    return name, args_json, call_id
+
+
 class XAIResponder:
     """
     Adaptador del SDK de xAI al simulador.
@@ -55,6 +86,22 @@ class XAIResponder:
     para que el servidor de xAI guarde el historial de la conversación.
     """
 
+    # Un único cliente (y canal gRPC) por API key para todos los responders
+    _shared_clients: ClassVar[Dict[str, XAIClient]] = {}
+    _shared_clients_lock: ClassVar[threading.Lock] = threading.Lock()
+
+    @classmethod
+    def _get_client(cls) -> XAIClient:
+        api_key = os.getenv("XAI_API_KEY")
+        if not api_key:
+            raise RuntimeError("XAI_API_KEY no está configurada")
+        with cls._shared_clients_lock:
+            client = cls._shared_clients.get(api_key)
+            if client is None:
+                client = XAIClient(api_key=api_key, timeout=3600)
+                cls._shared_clients[api_key] = client
+            return client
+
     def __init__(
         self,
         model: str,
@@ -67,125 +114,47 @@ class XAIResponder:
         self.temperature = temperature
         self.debug = debug
 
-        api_key = os.getenv("XAI_API_KEY")
-        if not api_key:
-            raise RuntimeError("XAI_API_KEY no está configurada")
-
-        self.client = XAIClient(api_key=api_key, timeout=3600)
+        self.client = self._get_client()
 
-    def _format_observation_message(self, o: Observation) -> str:
+    def _execute_tool(
+        self, name: str, args: Dict[str, Any], call_id: str, dispatch: ToolDispatch
+    ) -> Tuple[Dict[str, Any], Action | None]:
         """
-        Formatea una observación como mensaje de usuario.
-
-        Misma lógica que en OpenAIResponder para que el comportamiento sea
-        comparable entre proveedores.
-        Incluye pedidos no atendidos por falta de capacidad.
+        Ejecuta una tool en el simulador y devuelve (resultado, acción).
         """
-        time_str = o.get("time", "")
-        lts = o.get("last_turn_summary", {}) or {}
-        queue_len = int(lts.get("queue_end", 0))
-        dropped_from_queue = int(lts.get("dropped_from_queue", 0))
-        info_messages = lts.get("messages", []) or []
-        orders_served = lts.get("orders_served", []) or []
-        unserved_orders = lts.get("unserved_orders", []) or []
-
-        lines: List[str] = []
-
-        # Hora del turno actual
-        lines.append(f"Hora: {time_str}")
-
-        # Número de personas en cola
-        lines.append("")
-        lines.append(f"Hay {queue_len} personas esperando para pedir en la cola del puesto.")
-
-        # Mensajes informativos del turno anterior (incluye abandonos de la cola)
-        for msg in info_messages:
-            lines.append("")
-            lines.append(msg)
-        if not info_messages and dropped_from_queue > 0:
-            lines.append("")
-            lines.append(
-                f"{dropped_from_queue} persona{'s' if dropped_from_queue != 1 else ''} se han ido de la cola porque llevaban más de media hora esperando."
-            )
+        return execute_tool_call(dispatch, name, args, call_id)
 
-        # Pedidos servidos
-        if orders_served:
-            lines.append("")
-            lines.append("Pedidos servidos en los últimos 15 minutos:")
-            for i, order in enumerate(orders_served, 1):
-                items: Dict[str, Any] = {}
-                if isinstance(order, dict):
-                    items = order.get("items", order)
-                parts = [f"{int(qty)} {prod}" for prod, qty in items.items()]
-                lines.append(f"- Pedido {i}: " + ", ".join(parts))
-        else:
-            lines.append("")
-            lines.append("En los últimos 15 minutos no se ha servido ningún pedido.")
-
-        # Pedidos no atendidos por capacidad
-        if unserved_orders:
-            lines.append("")
-            lines.append("Pedidos que no han podido ser atendidos por capacidad:")
-            for i, order in enumerate(unserved_orders, 1):
-                items: Dict[str, Any] = {}
-                if isinstance(order, dict):
-                    items = order.get("items", order)
-                parts = [f"{int(qty)} {prod}" for prod, qty in items.items()]
-                lines.append(f"- Pedido {i}: " + ", ".join(parts))
-        else:
-            lines.append("")
-            lines.append("No ha quedado ningún pedido sin atender por capacidad.")
-
-        return "\n".join(lines)
+    def _run_tool_call(
+        self, name: str, args: Dict[str, Any], call_id: str, dispatch: ToolDispatch, actions: List[Action]
+    ) -> Dict[str, Any]:
+        """Ejecuta un tool_call en el simulador y devuelve su resultado en formato function_call_output."""
+        res, action = self._execute_tool(name, args, call_id, dispatch)
 
-    def _execute_tool(
-        self, name: str, args: Dict[str, Any], call_id: str, tools: ToolExecutor
-    ) -> Tuple[Dict[str, Any], Action | None]:
+        if action:
+            actions.append(action)
+
+        if self.debug:
+            printable_name = name or "<sin_nombre>"
+            print(f"  -> xAI tool ejecutada: {printable_name}")
+
+        return {
+            "type": "function_call_output",
+            "call_id": call_id,
+            "output": tool_result_json(res),
+        }
+
+    def record_replayed_turn(self, obs: Observation, actions: List[Action], tools: ToolExecutor) -> None:
         """
-        Ejecuta una tool en el simulador y devuelve (resultado, acción).
+        Registra un turno resuelto sin llamar a la API. El historial vive en el servidor, así que
+        la observación y las acciones aplicadas se envían al chat en la próxima petición.
         """
-        if name == "get_status":
-            res = tools.get_status(call_id=call_id, arguments={})
-            return res, {"type": "get_status"}
-        elif name == "get_prices":
-            res = tools.get_prices(call_id=call_id, arguments={})
-            return res, {"type": "get_prices"}
-        elif name == "set_prices":
-            prices_list = args.get("prices") or []
-            prices = {}
-            for it in prices_list:
-                product = it.get("product")
-                price = it.get("price")
-                if product and price is not None:
-                    prices[product] = float(price)
-            res = tools.set_prices(prices, call_id=call_id, arguments=args)
-            return res, {"type": "set_prices", "prices": prices}
-        elif name == "place_order":
-            items_list = args.get("items") or []
-            quantities = {}
-            for it in items_list:
-                ingredient = it.get("ingredient")
-                quantity = it.get("quantity")
-                if ingredient and quantity is not None:
-                    quantities[ingredient] = int(float(quantity))
-            workers = [int(w) for w in (args.get("workers") or []) if w is not None]
-            res = tools.place_order(quantities, workers, call_id=call_id, arguments=args)
-            return res, {"type": "place_order", "quantities": quantities, "workers": workers}
-        elif name == "assign_workers":
-            assignments_list = args.get("assignments") or []
-            assignments = []
-            for it in assignments_list:
-                emp_id = it.get("employee_id")
-                task = it.get("task")
-                if emp_id is not None and task is not None:
-                    assignments.append({"employee_id": int(emp_id), "task": task})
-            res = tools.assign_workers(assignments, call_id=call_id, arguments=args)
-            return res, {"type": "assign_workers", "assignments": assignments}
-        elif name == "end_turn":
-            res = tools.end_turn(call_id=call_id, arguments={})
-            return res, {"type": "end_turn"}
-        else:
-            return {"ok": False, "reason": f"Tool desconocida: {name}"}, None
+        engine = tools.engine
+        # Lista nueva: la anterior puede estar guardada en una entrada de la caché
+        engine.pending_tool_outputs = [
+            *engine.pending_tool_outputs,
+            {"role": "user", "content": format_observation_message(obs)},
+            {"role": "assistant", "content": replayed_turn_text(actions)},
+        ]
 
     def decide(
         self,
@@ -204,19 +173,22 @@ class XAIResponder:
         tokens_in_total = 0
         tokens_out_total = 0
 
-        system_prompt = _load_system_prompt()
-        tools_def = _to_xai_tools(_load_tools_config())
-        user_content = self._format_observation_message(obs)
+        tools_def = _get_cached_tools_def()
+        engine = tools.engine
+        dispatch = build_tool_dispatch(tools)
+        user_content = format_observation_message(obs)
 
         # Obtener previous_response_id si existe (para continuar conversación)
-        previous_response_id = getattr(tools.engine, "previous_response_id", None)
+        previous_response_id = engine.previous_response_id
 
-        # Crear el chat (nuevo cada vez, pero con previous_response_id para continuar)
-        create_kwargs: Dict[str, Any] = {
+        # Crear el chat (nuevo cada vez, pero con previous_response_id para continuar).
+        # Los campos comunes se construyen una vez y se reutilizan en las peticiones de seguimiento.
+        base_kwargs: Dict[str, Any] = {
             "model": self.model,
             "store_messages": True,  # El servidor guarda el historial
             "tools": tools_def,
         }
+        create_kwargs = dict(base_kwargs)
         if self.reasoning_effort:
             create_kwargs["reasoning_effort"] = self.reasoning_effort
         if previous_response_id:
@@ -226,17 +198,22 @@ class XAIResponder:
 
         # Solo añadir system prompt en el primer turno (sin previous_response_id)
         if not previous_response_id:
-            chat.append(system(system_prompt))
+            chat.append(system(load_system_prompt()))
 
         if self.debug:
             print(f"\n=== DEBUG xAI: Turno {obs.get('turn', '?')} ===")
             print(f"previous_response_id: {previous_response_id or 'None'}")
             try:
                 print("Observation actual:")
-                print(json.dumps(obs, indent=2, ensure_ascii=False))
+                print(orjson.dumps(obs, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS).decode())
             except TypeError:
                 print(f"Observation (raw): {obs}")
 
+        # Turnos resueltos desde la caché sin llamar a la API (ver record_replayed_turn)
+        for message in engine.pending_tool_outputs:
+            chat.append((user if message["role"] == "user" else assistant)(message["content"]))
+        engine.pending_tool_outputs = []
+
         # Añadir el mensaje de usuario del turno actual
         chat.append(user(user_content))
 
@@ -249,7 +226,7 @@ class XAIResponder:
             # Guardar el response.id para continuar la conversación
             response_id = getattr(response, "id", None)
             if response_id:
-                tools.engine.previous_response_id = response_id
+                engine.previous_response_id = response_id
 
             # Acumular tokens si están disponibles
             usage = getattr(response, "usage", None)
@@ -274,39 +251,34 @@ class XAIResponder:
                 if self.debug:
                     print("  -> Sin tool_calls, forzando end_turn")
                 tools.end_turn()
-                actions.append({"type": "end_turn"})
+                actions.append(END_TURN_ACTION)
                 turn_finished = True
                 break
 
             # Ejecutar todas las tools y recolectar los resultados
             tool_results: List[Dict[str, Any]] = []
+            deferred_end_turns: List[Tuple[Dict[str, Any], Any]] = []
             for tc in tool_calls:
                 # En el SDK de xAI, cada ToolCall tiene un campo .function con name y arguments.
-                function_obj = getattr(tc, "function", None)
-
-                if function_obj is not None:
-                    name = getattr(function_obj, "name", "") or ""
-                    args_json = getattr(function_obj, "arguments", "{}") or "{}"
-                elif isinstance(tc, dict):
-                    # Fallback defensivo por si en algún momento la SDK devolviera dicts
-                    func = tc.get("function", {}) or {}
-                    name = func.get("name") or tc.get("name", "") or ""
-                    args_json = func.get("arguments") or tc.get("arguments", "{}") or "{}"
-                else:
-                    name = ""
-                    args_json = "{}"
-
-                call_id = getattr(tc, "id", "") if hasattr(tc, "id") else tc.get("id", "") if isinstance(tc, dict) else ""
-
                 try:
-                    args = json.loads(args_json) if isinstance(args_json, str) else args_json
-                except Exception:
+                    function_obj = tc.function
+                    name = function_obj.name or ""
+                    args_json = function_obj.arguments or "{}"
+                    call_id = tc.id
+                except AttributeError:
+                    name, args_json, call_id = _tool_call_fields(tc)
+
+                if name in ZERO_ARG_TOOLS:
                     args = {}
+                else:
+                    try:
+                        args = orjson.loads(args_json) if isinstance(args_json, str) else args_json
+                    except Exception:
+                        args = {}
 
                 if self.debug:
-                    args_str = json.dumps(args, ensure_ascii=False) if args else "{}"
                     printable_name = name or "<sin_nombre>"
-                    print(f"  -> xAI tool_call: {printable_name}({args_str[:50]}...) id={str(call_id)[:20]}...")
+                    print(f"  -> xAI tool_call: {printable_name}({short_json(args or {})}) id={str(call_id)[:20]}...")
                     if not name:
                         # Ayuda a depurar si en algún momento cambia la estructura de ToolCall
                         try:
@@ -314,38 +286,28 @@ class XAIResponder:
                         except Exception:
                             pass
 
-                # Ejecutar la tool
-                res, action = self._execute_tool(name, args, call_id, tools)
-
-                if action:
-                    actions.append(action)
-
+                # end_turn se aplaza hasta aplicar el resto de tools de la respuesta. Se ejecutan
+                # en orden en este hilo: ToolExecutor modifica el estado del engine y no es thread-safe.
                 if name == "end_turn":
-                    turn_finished = True
+                    deferred_end_turns.append((args, call_id))
+                    continue
 
-                # Guardar el resultado para añadirlo al nuevo chat
-                tool_results.append(
-                    {
-                        "type": "function_call_output",
-                        "call_id": call_id,
-                        "output": json.dumps(res, ensure_ascii=False),
-                    }
-                )
+                # Ejecutar la tool y guardar el resultado para añadirlo al nuevo chat
+                tool_results.append(self._run_tool_call(name, args, call_id, dispatch, actions))
 
-                if self.debug:
-                    printable_name = name or "<sin_nombre>"
-                    print(f"  -> xAI tool ejecutada: {printable_name}")
+            # Con end_turn el turno termina: se ejecuta una sola vez aunque el modelo lo pida
+            # varias, y sus resultados ya no se envían al modelo
+            if deferred_end_turns:
+                args, call_id = deferred_end_turns[0]
+                self._run_tool_call("end_turn", args, call_id, dispatch, actions)
+                turn_finished = True
 
             if turn_finished:
                 break
 
-            # Crear nuevo chat con previous_response_id para enviar los resultados
-            chat = self.client.chat.create(
-                model=self.model,
-                store_messages=True,
-                tools=tools_def,
-                previous_response_id=tools.engine.previous_response_id,
-            )
+            # Crear nuevo chat con previous_response_id para enviar los resultados: el SDK
+            # no permite cambiar el previous_response_id de un chat existente
+            chat = self.client.chat.create(**base_kwargs, previous_response_id=engine.previous_response_id)
 
             # Añadir los resultados de las tools al nuevo chat
             for result in tool_results:
@@ -356,6 +318,6 @@ class XAIResponder:
                     print(f"  -> xAI tool result añadido: {str(call_id)[:20]}...")
 
         if self.debug:
-            print(f"=== DEBUG xAI: Fin del turno, response_id={tools.engine.previous_response_id} ===\n")
+            print(f"=== DEBUG xAI: Fin del turno, response_id={engine.previous_response_id} ===\n")
 
         return actions, tokens_in_total, tokens_out_total
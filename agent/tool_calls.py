@@ -0,0 +1,82 @@
+from __future__ import annotations
+
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from sim.engine import ToolExecutor
+from sim.types import Action, ToolResult
+
+
+# Parsers de argumentos de las tools (formato de tools.yml) a los kwargs del ToolExecutor.
+# Las tools sin argumentos (get_status, get_prices, end_turn) no tienen parser.
+
+def _parse_set_prices_args(args: Dict[str, Any]) -> Dict[str, Any]:
+    prices = {
+        # Los float (lo habitual) se usan tal cual; enteros y cadenas se convierten
+        product: price if type(price) is float else float(price)
+        for it in (args.get("prices") or [])
+        if (product := it.get("product")) and (price := it.get("price")) is not None
+    }
+    return {"prices": prices}
+
+
+def _parse_place_order_args(args: Dict[str, Any]) -> Dict[str, Any]:
+    quantities = {
+        # Los enteros (lo habitual) se usan tal cual y los float se truncan directamente;
+        # solo las cadenas ("2.5") pasan por float como antes
+        ingredient: (
+            quantity if type(quantity) is int
+            else int(quantity) if type(quantity) is float
+            else int(float(quantity))
+        )
+        for it in (args.get("items") or [])
+        if (ingredient := it.get("ingredient")) and (quantity := it.get("quantity")) is not None
+    }
+    workers = [int(w) for w in (args.get("workers") or []) if w is not None]
+    return {"quantities": quantities, "workers": workers}
+
+
+def _parse_assign_workers_args(args: Dict[str, Any]) -> Dict[str, Any]:
+    assignments = [
+        {"employee_id": int(emp_id), "task": task}
+        for it in (args.get("assignments") or [])
+        if (emp_id := it.get("employee_id")) is not None and (task := it.get("task")) is not None
+    ]
+    return {"assignments": assignments}
+
+
+_ARG_PARSERS: Dict[str, Callable[[Dict[str, Any]], Dict[str, Any]]] = {
+    "set_prices": _parse_set_prices_args,
+    "place_order": _parse_place_order_args,
+    "assign_workers": _parse_assign_workers_args,
+}
+
+_TOOL_NAMES = ("get_status", "get_prices", "set_prices", "place_order", "assign_workers", "end_turn")
+
+# Acciones de las tools sin argumentos: constantes y compartidas entre llamadas
+# (como el resto de acciones, nadie las modifica después de devolverlas)
+_STATIC_ACTIONS: Dict[str, Action] = {name: {"type": name} for name in _TOOL_NAMES if name not in _ARG_PARSERS}
+END_TURN_ACTION: Action = _STATIC_ACTIONS["end_turn"]
+
+# Tools sin argumentos: los proveedores no necesitan decodificar su JSON de argumentos
+ZERO_ARG_TOOLS = frozenset(_STATIC_ACTIONS)
+
+ToolDispatch = Dict[str, Tuple[Callable[..., ToolResult], Optional[Callable[[Dict[str, Any]], Dict[str, Any]]]]]
+
+
+def build_tool_dispatch(tools: ToolExecutor) -> ToolDispatch:
+    """Tabla nombre -> (método ligado del ToolExecutor, parser de argumentos) para un decide()."""
+    return {name: (getattr(tools, name), _ARG_PARSERS.get(name)) for name in _TOOL_NAMES}
+
+
+def execute_tool_call(
+    dispatch: ToolDispatch, name: str, args: Dict[str, Any], call_id: str
+) -> Tuple[Dict[str, Any], Optional[Action]]:
+    """Ejecuta una tool en el simulador y devuelve (resultado, acción)."""
+    method, parser = dispatch.get(name, (None, None))
+    if method is None:
+        return {"ok": False, "reason": f"Tool desconocida: {name}"}, None
+    if parser is None:
+        return method(call_id=call_id, arguments={}), _STATIC_ACTIONS[name]
+    parsed = parser(args)
+    res = method(call_id=call_id, arguments=args, **parsed)
+    return res, {"type": name, **parsed}
@@ -7,13 +7,15 @@ from typing import Optional
 
 import typer
 import numpy as np
+import orjson
 
 from sim.config import load_config
 from sim.engine import Simulator
 from agent.heuristic import HeuristicAgent
 from agent.llm_agent import LLMAgent
+from agent.llm_cache import LLMCache, SentenceTransformerEmbedder, ShelveBackend
 from agent.human_agent import HumanAgent
-from runner.experiment import run_experiments
+from runner.experiment import TRACE_JSON_OPTIONS, run_experiments
 
 
 app = typer.Typer(help="Simulador del puesto de txistorra - CLI")
@@ -45,7 +47,11 @@ def play(
     reasoning_effort: Optional[str] = typer.Option(None, help="low|medium|high (si aplica)"),
     save_trace: bool = typer.Option(True, help="Guardar traza JSONL en runs/"),
     debug: bool = typer.Option(False, help="Mostrar debug del historial de mensajes"),
+    llm_cache: Optional[str] = typer.Option(None, help="Ruta a una caché persistente (shelve) de respuestas LLM"),
+    semantic_cache: bool = typer.Option(False, help="Reutilizar decisiones de observaciones casi idénticas (requiere --llm-cache)"),
 ):
+    if semantic_cache and not llm_cache:
+        raise typer.BadParameter("--semantic-cache requiere --llm-cache")
     cfg = load_config(config)
     if seed is not None:
         cfg.seed = int(seed)
@@ -65,7 +71,17 @@ def play(
         if "/" not in agent:
             raise typer.BadParameter("Formato de agente inválido. Use provider/model o 'heuristic' o 'human'.")
         provider_name, model_name = agent.split("/", 1)
-        the_agent = LLMAgent(provider=provider_name, model=model_name, reasoning_effort=reasoning_effort, debug=debug)
+        cache = None
+        if llm_cache:
+            embedder = SentenceTransformerEmbedder() if semantic_cache else None
+            cache = LLMCache(ShelveBackend(llm_cache), embedder=embedder)
+        the_agent = LLMAgent(
+            provider=provider_name,
+            model=model_name,
+            reasoning_effort=reasoning_effort,
+            debug=debug,
+            cache=cache,
+        )
 
     runs_dir = pathlib.Path("runs")
     runs_dir.mkdir(exist_ok=True)
@@ -74,28 +90,37 @@ def play(
     safe_model = "".join(c if c.isalnum() or c in ("-", "_", ".") else "_" for c in model_name)
     trace_path = runs_dir / f"{safe_model}_{run_id}.jsonl"
 
-    wrote_header = False
+    trace_file = None
+    if save_trace:
+        # Un único fichero abierto durante el episodio: las líneas se acumulan en un
+        # buffer de 64 KiB y se vuelcan al cerrarlo (o al llenarse)
+        trace_file = trace_path.open("ab", buffering=1 << 16)
+        header = {
+            "type": "meta",
+            "model": model_name,
+            # Nombre abreviado (por defecto = nombre completo).
+            # Se puede editar a mano en la primera línea del .jsonl.
+            "model_short": model_name,
+            "provider": provider_name,
+            "reasoning_effort": reasoning_effort,
+            "date": run_id,
+        }
+        trace_file.write(orjson.dumps(header, option=TRACE_JSON_OPTIONS) + b"\n")
 
     def writer(d: dict) -> None:
-        nonlocal wrote_header
-        if save_trace:
-            with trace_path.open("a", encoding="utf-8") as f:
-                if not wrote_header:
-                    header = {
-                        "type": "meta",
-                        "model": model_name,
-                        # Nombre abreviado (por defecto = nombre completo).
-                        # Se puede editar a mano en la primera línea del .jsonl.
-                        "model_short": model_name,
-                        "provider": provider_name,
-                        "reasoning_effort": reasoning_effort,
-                        "date": run_id,
-                    }
-                    f.write(json.dumps(header, ensure_ascii=False) + "\n")
-                    wrote_header = True
-                f.write(json.dumps(d, ensure_ascii=False) + "\n")
-
-    metrics = sim.run_episode(the_agent, trace_writer=writer if save_trace else None)
+        trace_file.write(orjson.dumps(d, option=TRACE_JSON_OPTIONS) + b"\n")
+
+    cache = the_agent.cache if isinstance(the_agent, LLMAgent) else None
+    try:
+        metrics = sim.run_episode(the_agent, trace_writer=writer if save_trace else None)
+    finally:
+        if trace_file is not None:
+            trace_file.close()
+        # El shelve se cierra aunque el episodio falle, para no dejarlo a medio escribir
+        if cache is not None:
+            cache.close()
+    if cache is not None:
+        typer.echo(f"Caché LLM: {cache.stats} (hit-rate {cache.hit_rate:.0%})")
     typer.echo(json.dumps(metrics, indent=2, ensure_ascii=False))
     if save_trace:
         typer.echo(f"Traza guardada en: {trace_path}")
@@ -5,18 +5,40 @@ import json
 import pathlib
 import time
 import uuid
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from typing import Any, Dict, List
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from contextlib import ExitStack
+from dataclasses import asdict
+from typing import Any, Dict
 
 import numpy as np
+import orjson
 import yaml
 
+try:
+    from yaml import CSafeLoader as _YamlLoader
+except ImportError:  # PyYAML sin libyaml
+    from yaml import SafeLoader as _YamlLoader
+
 from sim.config import load_config
 from sim.engine import Simulator
 from agent.heuristic import HeuristicAgent
 from agent.llm_agent import LLMAgent
 
 
+# Columnas de summary.csv
+_SUMMARY_FIELDS = [
+    "run_id",
+    "model",
+    "reasoning",
+    "seed",
+    "cash_final",
+    "tool_calls",
+    "tokens_in",
+    "tokens_out",
+    "cost_total",
+]
+
+
 def _now_id() -> str:
     return time.strftime("%Y%m%d-%H%M%S")
 
@@ -25,19 +47,27 @@ def _ensure_dir(p: pathlib.Path) -> None:
     p.mkdir(parents=True, exist_ok=True)
 
 
+# Opciones de orjson para las trazas: claves no str (p. ej. workers_on_trip) y tipos numpy
+TRACE_JSON_OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+
+
 def _trace_writer(path: pathlib.Path, meta: Dict[str, Any] | None = None):
-    f = path.open("w", encoding="utf-8")
+    """
+    Devuelve (write, close) sobre un único fichero abierto durante todo el episodio.
+
+    Las líneas (JSON en UTF-8 generado por orjson) se acumulan en el buffer del
+    fichero (64 KiB) en vez de volcarse una a una; close() las escribe al terminar.
+    """
+    f = path.open("wb", buffering=1 << 16)
 
     # Escribimos una primera línea con metadatos del experimento si se proporciona
     if meta is not None:
-        f.write(json.dumps(meta, ensure_ascii=False) + "\n")
-        f.flush()
+        f.write(orjson.dumps(meta, option=TRACE_JSON_OPTIONS) + b"\n")
 
     def write(d: Dict[str, Any]) -> None:
-        f.write(json.dumps(d, ensure_ascii=False) + "\n")
-        f.flush()
+        f.write(orjson.dumps(d, option=TRACE_JSON_OPTIONS) + b"\n")
 
-    return write
+    return write, f.close
 
 
 def run_single(config_path: str, agent_spec: Dict[str, Any], seed: int, out_dir: pathlib.Path) -> Dict:
@@ -60,9 +90,7 @@ def run_single(config_path: str, agent_spec: Dict[str, Any], seed: int, out_dir:
     _ensure_dir(out_dir)
 
     # Guardar config efectiva
-    (out_dir / f"{run_id}_config.json").write_text(
-        json.dumps(cfg, default=lambda o: o.__dict__, indent=2), encoding="utf-8"
-    )
+    (out_dir / f"{run_id}_config.json").write_bytes(orjson.dumps(asdict(cfg), option=orjson.OPT_INDENT_2))
 
     # Nombre de traza: {model_name}_{date}.jsonl (sanitizado)
     safe_model = "".join(c if c.isalnum() or c in ("-", "_", ".") else "_" for c in model_name)
@@ -81,7 +109,11 @@ def run_single(config_path: str, agent_spec: Dict[str, Any], seed: int, out_dir:
         "seed": seed,
     }
 
-    metrics = sim.run_episode(agent, trace_writer=_trace_writer(trace_path, meta=trace_meta))
+    write_trace, close_trace = _trace_writer(trace_path, meta=trace_meta)
+    try:
+        metrics = sim.run_episode(agent, trace_writer=write_trace)
+    finally:
+        close_trace()
     (out_dir / f"{run_id}_metrics.json").write_text(json.dumps(metrics, indent=2), encoding="utf-8")
 
     return {
@@ -95,84 +127,76 @@ def run_single(config_path: str, agent_spec: Dict[str, Any], seed: int, out_dir:
 
 
 def run_experiments(experiments_path: str, out_root: str = "runs") -> pathlib.Path:
-    spec = yaml.safe_load(pathlib.Path(experiments_path).read_text(encoding="utf-8"))
+    # Una sola lectura: el mismo texto se parsea y se archiva junto a los resultados
+    raw_text = pathlib.Path(experiments_path).read_text(encoding="utf-8")
+    spec = yaml.load(raw_text, Loader=_YamlLoader)
     out_dir = pathlib.Path(out_root) / _now_id()
     _ensure_dir(out_dir)
-    (out_dir / "experiments.yaml").write_text(pathlib.Path(experiments_path).read_text(encoding="utf-8"), encoding="utf-8")
-
-    summary_rows: List[Dict[str, Any]] = []
-    for exp in spec.get("experiments", []):
-        config_path = exp["config_path"]
-        seeds = exp.get("seeds", [42])
-        replicas = int(exp.get("replicas", 1))
-        models = exp.get("models", [{"type": "heuristic"}])
-        max_workers = int(exp.get("max_workers", 0)) or None
-
-        tasks = []
-        for model in models:
-            for seed in seeds:
-                for r in range(replicas):
-                    tasks.append((model, seed, r))
-
-        with ThreadPoolExecutor(max_workers=max_workers) as executor:
-            future_map = {
-                executor.submit(run_single, config_path, model, seed, out_dir): (model, seed, r) for model, seed, r in tasks
-            }
-
-            for fut in as_completed(future_map):
-                model, seed, _ = future_map[fut]
-                try:
-                    res = fut.result()
-                except Exception as exc:  # pragma: no cover
-                    summary_rows.append(
-                        {
-                            "run_id": "error",
-                            "model": f"{model.get('provider', 'heuristic')}/{model.get('model', 'heuristic')}",
-                            "reasoning": model.get("reasoning_effort", ""),
-                            "seed": seed,
-                            "cash_final": "error",
-                            "tool_calls": "error",
-                            "tokens_in": "error",
-                            "tokens_out": "error",
-                            "cost_total": f"error: {exc}",
-                        }
-                    )
-                    continue
-
-                summary_rows.append(
-                    {
-                        "run_id": res["run_id"],
+    (out_dir / "experiments.yaml").write_text(raw_text, encoding="utf-8")
+
+    # summary.csv se escribe según van terminando las partidas (y se vuelca cada pocas),
+    # así una ejecución interrumpida conserva las filas ya completadas
+    csv_path = out_dir / "summary.csv"
+    with csv_path.open("w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=_SUMMARY_FIELDS)
+        writer.writeheader()
+
+        for exp in spec.get("experiments", []):
+            config_path = exp["config_path"]
+            seeds = exp.get("seeds", [42])
+            replicas = int(exp.get("replicas", 1))
+            models = exp.get("models", [{"type": "heuristic"}])
+            max_workers = int(exp.get("max_workers", 0)) or None
+
+            tasks = []
+            for model in models:
+                for seed in seeds:
+                    for r in range(replicas):
+                        tasks.append((model, seed, r))
+
+            # Las partidas del heurístico son CPU puro (el GIL serializa los hilos): van a un pool de
+            # procesos. Las de LLM esperan a la red y siguen en hilos.
+            heuristic_tasks = [t for t in tasks if t[0].get("type", "heuristic") == "heuristic"]
+            llm_tasks = [t for t in tasks if t[0].get("type", "heuristic") != "heuristic"]
+            flush_every = max(1, len(tasks) // 32)
+
+            with ExitStack() as pools:
+                future_map = {}
+                for pool_cls, pool_tasks in ((ProcessPoolExecutor, heuristic_tasks), (ThreadPoolExecutor, llm_tasks)):
+                    if not pool_tasks:
+                        continue
+                    executor = pools.enter_context(pool_cls(max_workers=max_workers))
+                    for model, seed, r in pool_tasks:
+                        future_map[executor.submit(run_single, config_path, model, seed, out_dir)] = (model, seed, r)
+
+                for done, fut in enumerate(as_completed(future_map), 1):
+                    model, seed, _ = future_map[fut]
+                    row: Dict[str, Any] = {
                         "model": f"{model.get('provider', 'heuristic')}/{model.get('model', 'heuristic')}",
                         "reasoning": model.get("reasoning_effort", ""),
                         "seed": seed,
-                        "cash_final": res["cash_final"],
-                        "tool_calls": res["tool_calls"],
-                        "tokens_in": res["tokens_in"],
-                        "tokens_out": res["tokens_out"],
-                        "cost_total": res["cost_total"],
                     }
-                )
-
-    # Guardar summary.csv
-    csv_path = out_dir / "summary.csv"
-    if summary_rows:
-        with csv_path.open("w", newline="", encoding="utf-8") as f:
-            writer = csv.DictWriter(
-                f,
-                fieldnames=[
-                    "run_id",
-                    "model",
-                    "reasoning",
-                    "seed",
-                    "cash_final",
-                    "tool_calls",
-                    "tokens_in",
-                    "tokens_out",
-                    "cost_total",
-                ],
-            )
-            writer.writeheader()
-            writer.writerows(summary_rows)
+                    try:
+                        res = fut.result()
+                    except Exception as exc:  # pragma: no cover
+                        row.update(
+                            run_id="error",
+                            cash_final="error",
+                            tool_calls="error",
+                            tokens_in="error",
+                            tokens_out="error",
+                            cost_total=f"error: {exc}",
+                        )
+                    else:
+                        row.update(
+                            run_id=res["run_id"],
+                            cash_final=res["cash_final"],
+                            tool_calls=res["tool_calls"],
+                            tokens_in=res["tokens_in"],
+                            tokens_out=res["tokens_out"],
+                            cost_total=res["cost_total"],
+                        )
+                    writer.writerow(row)
+                    if done % flush_every == 0:
+                        f.flush()
     return out_dir
-
-
@@ -1,10 +1,16 @@
 from __future__ import annotations
 
+import functools
 import pathlib
 from typing import Any, Dict, List
 
 import yaml
 
+try:
+    from yaml import CSafeLoader as _YamlLoader
+except ImportError:  # PyYAML sin libyaml
+    from yaml import SafeLoader as _YamlLoader
+
 from .types import Config, DemandParams, InitialState, OrderMixSegment, OrderProfile
 
 
@@ -63,10 +69,19 @@ def _as_config(d: Dict[str, Any]) -> Config:
     return cfg
 
 
-def load_config(path: str | pathlib.Path) -> Config:
-    p = pathlib.Path(path)
-    with p.open("r", encoding="utf-8") as f:
-        raw = yaml.safe_load(f)
-    return _as_config(raw)
+@functools.lru_cache(maxsize=32)
+def _load_raw(path: pathlib.Path, mtime_ns: int, size: int) -> Dict[str, Any]:
+    """
+    YAML parseado, cacheado por (ruta, mtime, tamaño): si el fichero cambia, se vuelve a leer.
 
+    El dict es compartido entre llamadas: _as_config solo lo lee y construye
+    contenedores nuevos, así que cada Config es independiente.
+    """
+    with path.open("r", encoding="utf-8") as f:
+        return yaml.load(f, Loader=_YamlLoader)
 
+
+def load_config(path: str | pathlib.Path) -> Config:
+    p = pathlib.Path(path).resolve()
+    st = p.stat()
+    return _as_config(_load_raw(p, st.st_mtime_ns, st.st_size))
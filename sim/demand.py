@@ -1,12 +1,15 @@
 from __future__ import annotations
 
-import math
-from typing import Dict
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
 
 import numpy as np
 
 from .types import DemandParams, Order, PriceMap, ProductName
 
+# Cuota del agente cuando su atractividad es 1, igual que la de cada uno de los 3 competidores
+_EQUAL_SHARE_AGENT = 1.0 / (1.0 + 3.0)
+
 
 def _find_order_mix_segment(params: DemandParams, turn_idx: int) -> Dict[str, float]:
     """
@@ -28,45 +31,141 @@ def _find_order_mix_segment(params: DemandParams, turn_idx: int) -> Dict[str, fl
     return {}
 
 
-def _sample_profile(profile_probs: Dict[str, float], rng: np.random.Generator) -> str:
+@dataclass
+class ProfileDistribution:
     """
-    Muestrea un perfil de pedido según las probabilidades dadas.
+    Mezcla de perfiles lista para muestrear todos los clientes de un turno de una vez.
+
+    - `names` / `probs`: perfiles y probabilidades normalizadas (uniformes si no suman nada).
+    - `items`: items de cada perfil, compartidos (de solo lectura) por todos sus pedidos.
+    - `products` / `demand`: matriz [perfil x producto] de unidades para agregar la demanda con numpy.
     """
-    names = list(profile_probs.keys())
+
+    names: Tuple[str, ...]
+    probs: np.ndarray
+    items: Tuple[Dict[ProductName, int], ...]
+    products: Tuple[ProductName, ...]
+    demand: np.ndarray
+
+
+def _profile_distribution(params: DemandParams, profile_probs: Dict[str, float]) -> ProfileDistribution:
+    names = tuple(profile_probs.keys())
     probs = np.array([float(profile_probs[n]) for n in names], dtype=float)
     total = probs.sum()
     if total <= 0:
         probs = np.ones_like(probs) / len(probs)
     else:
         probs = probs / total
-    idx = int(rng.choice(len(names), p=probs))
-    return names[idx]
+
+    profiles = [params.order_profiles[n] for n in names]
+    products: List[ProductName] = ["pintxo", "bocadillo", "sidra"]
+    for profile in profiles:
+        products.extend(p for p in profile.items if p not in products)
+    demand = np.array(
+        [[int(profile.items.get(p, 0)) for p in products] for profile in profiles], dtype=np.int64
+    ).reshape(len(profiles), len(products))
+    return ProfileDistribution(
+        names=names,
+        probs=probs,
+        items=tuple(profile.items for profile in profiles),
+        products=tuple(products),
+        demand=demand,
+    )
+
+
+# Términos del ticket medio de una mezcla de perfiles: ((prob, ((producto, unidades), ...)), ...)
+TicketTerms = Tuple[Tuple[float, Tuple[Tuple[ProductName, float], ...]], ...]
+
+
+def _ticket_terms(params: DemandParams, profile_probs: Dict[str, float]) -> TicketTerms:
+    """Probabilidad y unidades por producto de cada perfil, ya convertidas a float y en orden."""
+    return tuple(
+        (float(prob), tuple((product, float(qty)) for product, qty in params.order_profiles[name].items.items()))
+        for name, prob in profile_probs.items()
+    )
+
+
+@dataclass
+class DemandTables:
+    """
+    Datos de demanda derivados de DemandParams, precalculados una vez por episodio.
+
+    Tablas indexadas por turno: la mezcla de perfiles de cada turno, su distribución
+    ya normalizada, los términos del ticket medio (los turnos de un mismo segmento
+    comparten los mismos objetos) y el ticket medio del competidor, que solo depende
+    de price_ref.
+    """
+
+    profile_probs_by_turn: List[Dict[str, float]]
+    distribution_by_turn: List[ProfileDistribution]
+    ticket_terms_by_turn: List[TicketTerms]
+    ticket_comp_by_turn: List[float]
+
+
+def build_demand_tables(params: DemandParams, num_turns: int) -> DemandTables:
+    """Construye las tablas por turno recorriendo los segmentos una sola vez por turno."""
+    profile_probs_by_turn: List[Dict[str, float]] = []
+    distribution_by_turn: List[ProfileDistribution] = []
+    ticket_terms_by_turn: List[TicketTerms] = []
+    # Un único cálculo por segmento (clave: identidad de su profile_probs)
+    per_segment: Dict[int, Tuple[ProfileDistribution, TicketTerms]] = {}
+    for t in range(max(num_turns, len(params.customers_curve))):
+        profile_probs = _find_order_mix_segment(params, t)
+        derived = per_segment.get(id(profile_probs))
+        if derived is None:
+            derived = per_segment[id(profile_probs)] = (
+                _profile_distribution(params, profile_probs),
+                _ticket_terms(params, profile_probs),
+            )
+        profile_probs_by_turn.append(profile_probs)
+        distribution_by_turn.append(derived[0])
+        ticket_terms_by_turn.append(derived[1])
+    tables = DemandTables(
+        profile_probs_by_turn=profile_probs_by_turn,
+        distribution_by_turn=distribution_by_turn,
+        ticket_terms_by_turn=ticket_terms_by_turn,
+        ticket_comp_by_turn=[],
+    )
+    tables.ticket_comp_by_turn = [
+        _compute_expected_ticket(params.price_ref, params, t, tables) for t in range(len(profile_probs_by_turn))
+    ]
+    return tables
+
+
+def _turn_profile_probs(params: DemandParams, turn_idx: int, tables: Optional[DemandTables]) -> Dict[str, float]:
+    """Mezcla de perfiles del turno: de la tabla si existe, si no recorriendo los segmentos."""
+    if tables is not None and 0 <= turn_idx < len(tables.profile_probs_by_turn):
+        return tables.profile_probs_by_turn[turn_idx]
+    return _find_order_mix_segment(params, turn_idx)
 
 
 def _compute_expected_ticket(
     prices: PriceMap,
     params: DemandParams,
     turn_idx: int,
+    tables: Optional[DemandTables] = None,
 ) -> float:
     """
     Estima el precio medio de ticket de un cliente en este turno,
     usando la mezcla de productos configurada.
     """
     # Para el ticket medio, usamos los perfiles ponderados por su probabilidad
-    profile_probs = _find_order_mix_segment(params, turn_idx)
+    if tables is not None and 0 <= turn_idx < len(tables.ticket_terms_by_turn):
+        terms = tables.ticket_terms_by_turn[turn_idx]
+    else:
+        terms = _ticket_terms(params, _find_order_mix_segment(params, turn_idx))
     expected = 0.0
-    if not profile_probs:
+    if not terms:
         # Fallback: media simple de precios de productos
         for p in ["pintxo", "bocadillo", "sidra"]:
             expected += float(prices[p]) / 3.0
         return expected
 
-    for profile_name, prob in profile_probs.items():
-        profile = params.order_profiles[profile_name]
+    for prob, quantities in terms:
         ticket_profile = 0.0
-        for product, qty in profile.items.items():
-            ticket_profile += float(qty) * float(prices[product])
-        expected += float(prob) * ticket_profile
+        for product, qty in quantities:
+            ticket_profile += qty * float(prices[product])
+        expected += prob * ticket_profile
     return expected
 
 
@@ -75,6 +174,7 @@ def sample_customers_for_agent(
     params: DemandParams,
     turn_idx: int,
     rng: np.random.Generator,
+    tables: Optional[DemandTables] = None,
 ) -> int:
     """
     Calcula cuántos clientes de mercado eligen el puesto del agente en este turno.
@@ -89,9 +189,12 @@ def sample_customers_for_agent(
     market_customers = float(params.customers_curve[turn_idx])
 
     # 2) Precio medio de ticket del agente y del competidor
-    ticket_agent = _compute_expected_ticket(prices, params, turn_idx)
-    # Para los competidores usamos price_ref como sus precios fijos
-    ticket_comp = _compute_expected_ticket(params.price_ref, params, turn_idx)
+    ticket_agent = _compute_expected_ticket(prices, params, turn_idx, tables)
+    # Para los competidores usamos price_ref como sus precios fijos (constante por turno)
+    if tables is not None and 0 <= turn_idx < len(tables.ticket_comp_by_turn):
+        ticket_comp = tables.ticket_comp_by_turn[turn_idx]
+    else:
+        ticket_comp = _compute_expected_ticket(params.price_ref, params, turn_idx, tables)
 
     epsilon_c = float(params.elasticity_customers)
 
@@ -99,13 +202,17 @@ def sample_customers_for_agent(
     ticket_comp = max(ticket_comp, 1e-6)
 
     # 3) Atractividad del agente vs 3 competidores
-    a_agent = math.pow(ticket_agent / ticket_comp, -epsilon_c)
-    a_comp = 1.0
-    total_attr = a_agent + 3.0 * a_comp
-    if total_attr <= 1e-12:
-        share_agent = 0.0
+    if epsilon_c == 0.0 or ticket_agent == ticket_comp:
+        # Atractividad 1 frente a 3 competidores iguales: cuota 1/4 sin calcular la potencia
+        share_agent = _EQUAL_SHARE_AGENT
     else:
-        share_agent = a_agent / total_attr
+        a_agent = (ticket_agent / ticket_comp) ** -epsilon_c
+        a_comp = 1.0
+        total_attr = a_agent + 3.0 * a_comp
+        if total_attr <= 1e-12:
+            share_agent = 0.0
+        else:
+            share_agent = a_agent / total_attr
 
     expected_customers_agent = market_customers * share_agent
 
@@ -124,10 +231,13 @@ def sample_orders_for_agent(
     params: DemandParams,
     turn_idx: int,
     rng: np.random.Generator,
+    tables: Optional[DemandTables] = None,
 ) -> Dict[str, any]:
     """
     Genera los pedidos (cola nueva) que llegan al puesto del agente en este turno.
 
+    `tables` (de build_demand_tables) evita recalcular por turno la mezcla de perfiles.
+
     Devuelve:
         {
             "orders": List[Order],
@@ -135,22 +245,24 @@ def sample_orders_for_agent(
             "demand_products": Dict[ProductName, int]  # demanda de productos de los NUEVOS clientes
         }
     """
-    new_customers = sample_customers_for_agent(prices, params, turn_idx, rng)
-    profile_probs = _find_order_mix_segment(params, turn_idx)
+    new_customers = sample_customers_for_agent(prices, params, turn_idx, rng, tables)
+    profile_probs = _turn_profile_probs(params, turn_idx, tables)
 
     orders: list[Order] = []
     # Inicializamos demanda agregada a cero para todos los productos
     demand_products: Dict[ProductName, int] = {"pintxo": 0, "bocadillo": 0, "sidra": 0}
 
-    for _ in range(new_customers):
-        if not profile_probs:
-            break
-        profile_name = _sample_profile(profile_probs, rng)
-        profile = params.order_profiles[profile_name]
-        items: Dict[ProductName, int] = dict(profile.items)
-        orders.append({"items": items, "arrival_turn": turn_idx})
-        for product, qty in items.items():
-            demand_products[product] = demand_products.get(product, 0) + int(qty)
+    if new_customers > 0 and profile_probs:
+        if tables is not None and 0 <= turn_idx < len(tables.distribution_by_turn):
+            dist = tables.distribution_by_turn[turn_idx]
+        else:
+            dist = _profile_distribution(params, profile_probs)
+        # Un único sorteo para todos los clientes nuevos (misma secuencia que uno por cliente)
+        idxs = rng.choice(len(dist.names), size=new_customers, p=dist.probs)
+        # Los pedidos comparten los items (de solo lectura) de su perfil: el engine los copia al exponerlos
+        profile_items = dist.items
+        orders = [{"items": profile_items[i], "arrival_turn": turn_idx} for i in idxs.tolist()]
+        demand_products.update(zip(dist.products, dist.demand[idxs].sum(axis=0).tolist()))
 
     return {
         "orders": orders,
@@ -6,7 +6,7 @@ from typing import Any, Callable, Dict, List, Optional, Tuple
 
 import numpy as np
 
-from .demand import sample_orders_for_agent
+from .demand import build_demand_tables, sample_orders_for_agent
 from .types import (
     Action,
     Config,
@@ -41,6 +41,14 @@ def format_time(turn_idx: int) -> str:
 class ToolExecutor:
     def __init__(self, engine: "Simulator"):
         self.engine = engine
+        # Resultados de las tools de solo lectura memoizados dentro del turno.
+        # Se invalidan con cualquier tool que modifique el estado y al cambiar de turno.
+        self._status_cache: Optional[ToolResult] = None
+        self._prices_cache: Optional[ToolResult] = None
+
+    def invalidate_cache(self) -> None:
+        self._status_cache = None
+        self._prices_cache = None
 
     def _record_tool_call(self, name: str, call_id: str, arguments: Dict[str, Any], result: ToolResult) -> None:
         """Guarda los detalles de una tool_call para el trace unificado del agente."""
@@ -53,34 +61,55 @@ class ToolExecutor:
         }
         self.engine.agent_actions_trace.append(entry)
 
-    def get_status(self, call_id: str = "", arguments: Optional[Dict[str, Any]] = None) -> ToolResult:
-        self.engine.metrics_tool_calls += 1
-        s = self.engine.state
-        # Exponemos al agente las entregas entrantes con hora legible (HH:MM)
-        # en lugar del índice de turno interno.
-        inbound_view = [
-            {
-                "arrival_time": format_time(d["arrival_turn"]),
-                "quantities": dict(d["quantities"]),
-            }
-            for d in s.inbound_deliveries
-        ]
-        result = ToolResult(
+    @staticmethod
+    def _copy_status(result: ToolResult) -> ToolResult:
+        """Copia con contenedores propios de un resultado de get_status memoizado."""
+        return ToolResult(
             ok=True,
-            cash=s.cash,
-            stock_on_hand=dict(s.stock_on_hand),
-            inbound_deliveries=inbound_view,
-            worker_assignments=list(s.worker_assignments),
-            workers_on_trip=dict(s.workers_on_trip),
+            cash=result["cash"],
+            stock_on_hand=dict(result["stock_on_hand"]),
+            inbound_deliveries=[
+                {"arrival_time": d["arrival_time"], "quantities": dict(d["quantities"])}
+                for d in result["inbound_deliveries"]
+            ],
+            worker_assignments=[dict(a) for a in result["worker_assignments"]],
+            workers_on_trip=dict(result["workers_on_trip"]),
         )
-        self._record_tool_call("get_status", call_id, arguments or {}, result)
-        return result
+
+    def get_status(self, call_id: str = "", arguments: Optional[Dict[str, Any]] = None) -> ToolResult:
+        self.engine.metrics_tool_calls += 1
+        cached = self._status_cache
+        if cached is None:
+            s = self.engine.state
+            # Exponemos al agente las entregas entrantes con hora legible (HH:MM)
+            # en lugar del índice de turno interno.
+            inbound_view = [
+                {
+                    "arrival_time": format_time(d["arrival_turn"]),
+                    "quantities": dict(d["quantities"]),
+                }
+                for d in s.inbound_deliveries
+            ]
+            cached = ToolResult(
+                ok=True,
+                cash=s.cash,
+                stock_on_hand=dict(s.stock_on_hand),
+                inbound_deliveries=inbound_view,
+                worker_assignments=[dict(a) for a in s.worker_assignments],
+                workers_on_trip=dict(s.workers_on_trip),
+            )
+            self._status_cache = cached
+        self._record_tool_call("get_status", call_id, arguments or {}, cached)
+        # El resultado memoizado no sale del executor: cada llamada recibe su propia copia,
+        # de modo que modificarla no altera la caché ni las entradas ya registradas en la traza
+        return self._copy_status(cached)
 
     def get_prices(self, call_id: str = "", arguments: Optional[Dict[str, Any]] = None) -> ToolResult:
         self.engine.metrics_tool_calls += 1
-        result = ToolResult(ok=True, current_prices=dict(self.engine.state.prices))
-        self._record_tool_call("get_prices", call_id, arguments or {}, result)
-        return result
+        if self._prices_cache is None:
+            self._prices_cache = ToolResult(ok=True, current_prices=dict(self.engine.state.prices))
+        self._record_tool_call("get_prices", call_id, arguments or {}, self._prices_cache)
+        return ToolResult(ok=True, current_prices=dict(self._prices_cache["current_prices"]))
 
     def set_prices(self, prices: PriceMap, call_id: str = "", arguments: Optional[Dict[str, Any]] = None) -> ToolResult:
         self.engine.metrics_tool_calls += 1
@@ -91,6 +120,7 @@ class ToolExecutor:
                 self._record_tool_call("set_prices", call_id, arguments or {"prices": prices}, result)
                 return result
         self.engine.state.prices.update(prices)
+        self.invalidate_cache()
         result = ToolResult(ok=True)
         self._record_tool_call("set_prices", call_id, arguments or {"prices": prices}, result)
         return result
@@ -156,6 +186,7 @@ class ToolExecutor:
             return result
 
         # Aceptada: se descuenta caja y se programa entrega
+        self.invalidate_cache()
         self.engine.state.cash -= cost
         arrival_turn = self.engine.state.turn + self.engine.config.lead_time
         self.engine.state.inbound_deliveries.append(
@@ -230,6 +261,7 @@ class ToolExecutor:
                 return result
 
         self.engine._set_worker_assignments(assignments)
+        self.invalidate_cache()
         capacities = self.engine.state.worker_capacities
         result = ToolResult(
             ok=True,
@@ -241,6 +273,7 @@ class ToolExecutor:
     def end_turn(self, call_id: str = "", arguments: Optional[Dict[str, Any]] = None) -> ToolResult:
         self.engine.metrics_tool_calls += 1
         self.engine._end_turn_requested = True
+        self.invalidate_cache()
         result = ToolResult(ok=True)
         self._record_tool_call("end_turn", call_id, arguments or {}, result)
         return result
@@ -250,12 +283,15 @@ class Simulator:
     def __init__(self, config: Config, rng: Optional[np.random.Generator] = None):
         self.config = config
         self.rng = rng or np.random.default_rng(config.seed)
+        # Tablas de demanda por turno (solo dependen de la config, no del estado)
+        self.demand_tables = build_demand_tables(config.demand, config.num_turns)
         self.state: State = self._init_state()
         # Identificador de la última respuesta de OpenAI para reusar contexto server-side
         self.previous_response_id: Optional[str] = None
         # Traza unificada de acciones del agente (razonamientos + tool_calls) en este turno
         self.agent_actions_trace: List[Dict[str, Any]] = []
-        # Salidas de tool pendientes de enviar al próximo turno (para previous_response_id)
+        # Entradas pendientes de enviar al próximo turno (para previous_response_id): salidas de
+        # tool y, tras un turno resuelto desde la caché, su observación y sus acciones
         self.pending_tool_outputs: List[Dict[str, Any]] = []
         # Métricas por episodio
         self.metrics_tool_calls = 0
@@ -404,7 +440,7 @@ class Simulator:
 
         # 1) Llegan nuevos pedidos para este turno
         new_batch = sample_orders_for_agent(
-            self.state.prices, self.config.demand, turn_idx, self.rng
+            self.state.prices, self.config.demand, turn_idx, self.rng, self.demand_tables
         )
         new_orders = new_batch["orders"]
         new_customers = int(new_batch["new_customers"])
@@ -555,6 +591,7 @@ class Simulator:
             self.state.turn = t
             self._end_turn_requested = False
             self.agent_actions_trace = []  # Resetear acciones del agente del turno
+            tools.invalidate_cache()  # El estado cambia entre turnos (entregas, ventas, viajes)
 
             # Actualizar viajes de workers antes de decisiones
             self._update_worker_trips()
@@ -634,7 +671,8 @@ class Simulator:
                         "turn": t,
                         "time": format_time(t),
                         "state_before": state_before_snapshot,
-                        "agent_actions": list(self.agent_actions_trace),
+                        # Cada turno empieza con una lista nueva: se entrega sin copiarla
+                        "agent_actions": self.agent_actions_trace,
                         "tool_calls_count": tool_calls_this_turn,
                         # Lista de pedidos servidos durante este turno (ya aplicando colas/capacidades)
                         "orders_served": orders_served,
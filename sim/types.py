@@ -217,6 +217,38 @@ class Action(TypedDict, total=False):
     workers: List[int]
 
 
+# Variantes concretas de Action. Se construyen siempre con las claves en el mismo
+# orden para que CPython comparta la tabla de claves entre diccionarios.
+
+
+class GetStatusAction(TypedDict):
+    type: Literal["get_status"]
+
+
+class GetPricesAction(TypedDict):
+    type: Literal["get_prices"]
+
+
+class SetPricesAction(TypedDict):
+    type: Literal["set_prices"]
+    prices: PriceMap
+
+
+class PlaceOrderAction(TypedDict):
+    type: Literal["place_order"]
+    quantities: StockMap
+    workers: List[int]
+
+
+class AssignWorkersAction(TypedDict):
+    type: Literal["assign_workers"]
+    assignments: List["EmployeeAssignment"]
+
+
+class EndTurnAction(TypedDict):
+    type: Literal["end_turn"]
+
+
 class EmployeeAssignment(TypedDict):
     employee_id: int
     task: TaskName
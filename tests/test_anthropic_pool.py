@@ -0,0 +1,91 @@
+from __future__ import annotations
+
+import contextlib
+import time
+import types
+import unittest
+from typing import Any, List
+
+from agent.providers.anthropic import _RateLimitedMessages, _TokenBucket
+
+USAGE = types.SimpleNamespace(
+    input_tokens=300, output_tokens=200, cache_creation_input_tokens=None, cache_read_input_tokens=0
+)
+REQUEST = {"max_tokens": 20000, "system": "prompt", "messages": [{"role": "user", "content": "hola"}]}
+
+
+class FakeMessages:
+    """client.beta.messages sin red: cada petición consume USAGE y anota cómo se cerró el stream."""
+
+    def __init__(self) -> None:
+        self.exits: List[Any] = []
+
+    def create(self, **kwargs: Any) -> Any:
+        return types.SimpleNamespace(usage=USAGE)
+
+    @contextlib.contextmanager
+    def stream(self, **kwargs: Any) -> Any:
+        try:
+            yield types.SimpleNamespace(get_final_message=lambda: types.SimpleNamespace(usage=USAGE))
+        except BaseException as exc:
+            self.exits.append(exc)
+            raise
+        self.exits.append(None)
+
+
+def _limited(messages: FakeMessages, tokens_per_minute: int = 16000) -> _RateLimitedMessages:
+    rpm = _TokenBucket(6000, 100.0)
+    tpm = _TokenBucket(tokens_per_minute, tokens_per_minute / 60.0)
+    return _RateLimitedMessages(messages, rpm, tpm)
+
+
+class RateLimitedMessagesTest(unittest.TestCase):
+    def test_max_tokens_above_capacity_does_not_serialize_requests(self) -> None:
+        limited = _limited(FakeMessages())
+        start = time.monotonic()
+        for _ in range(10):
+            limited.create(**REQUEST)
+            with limited.stream(**REQUEST) as stream:
+                stream.get_final_message()
+        self.assertLess(time.monotonic() - start, 1.0)
+
+    def test_actual_usage_is_reconciled(self) -> None:
+        limited = _limited(FakeMessages())
+        limited.create(**REQUEST)
+        # Tras conciliar solo quedan descontados los 500 tokens reales (más la recarga del intervalo)
+        self.assertGreater(limited._tpm._tokens, 16000 - 500 - 1)
+        self.assertLessEqual(limited._tpm._tokens, 16000 - 500 + 1)
+
+    def test_stream_exit_receives_exception(self) -> None:
+        messages = FakeMessages()
+        limited = _limited(messages)
+        with self.assertRaises(KeyError):
+            with limited.stream(**REQUEST):
+                raise KeyError("tool")
+        self.assertIsInstance(messages.exits[0], KeyError)
+        with limited.stream(**REQUEST):
+            pass
+        self.assertIsNone(messages.exits[1])
+
+    def test_failed_stream_returns_its_tokens(self) -> None:
+        limited = _limited(FakeMessages())
+        for _ in range(20):
+            with self.assertRaises(KeyError):
+                with limited.stream(**REQUEST):
+                    raise KeyError("tool")
+        # Sin usage parcial se devuelve la estimación: el cubo no mengua con cada fallo
+        self.assertGreater(limited._tpm._tokens, 16000 - 1)
+
+    def test_failed_stream_is_settled_with_partial_usage(self) -> None:
+        messages = FakeMessages()
+        snapshot = types.SimpleNamespace(current_message_snapshot=types.SimpleNamespace(usage=USAGE))
+        messages.stream = contextlib.contextmanager(lambda **kwargs: (yield snapshot))
+        limited = _limited(messages)
+        with self.assertRaises(KeyError):
+            with limited.stream(**REQUEST):
+                raise KeyError("tool")
+        self.assertLessEqual(limited._tpm._tokens, 16000 - 500 + 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,122 @@
+from __future__ import annotations
+
+import contextlib
+import os
+import pathlib
+import types
+import unittest
+from typing import Any, List, Tuple
+from unittest import mock
+
+import numpy as np
+import orjson
+from google.genai import types as gtypes
+
+from agent.providers import gemini
+from agent.providers.anthropic import AnthropicResponder
+from agent.providers.gemini import GeminiResponder
+from agent.providers.openai import OpenAIResponder
+from agent.providers.xai import XAIResponder
+from sim.config import load_config
+from sim.engine import Simulator, ToolExecutor
+
+CONFIG_PATH = pathlib.Path(__file__).resolve().parents[1] / "configs" / "config.yml"
+
+# Respuesta del modelo en todos los proveedores: end_turn duplicado alrededor de otra tool
+CALLS: List[Tuple[str, str, dict]] = [
+    ("c1", "end_turn", {}),
+    ("c2", "set_prices", {"prices": [{"product": "pintxo", "price": 3.5}]}),
+    ("c3", "end_turn", {}),
+]
+NS = types.SimpleNamespace
+
+
+@contextlib.contextmanager
+def _anthropic_stream(**kwargs: Any) -> Any:
+    content = [NS(type="tool_use", name=name, input=args, id=call_id) for call_id, name, args in CALLS]
+    message = NS(
+        content=content,
+        usage=NS(input_tokens=1, output_tokens=1, cache_creation_input_tokens=None, cache_read_input_tokens=0),
+    )
+
+    class Stream:
+        def __iter__(self):
+            for i, block in enumerate(content):
+                yield NS(type="content_block_start", index=i)
+                yield NS(type="content_block_stop", index=i, content_block=block)
+
+        def get_final_message(self):
+            return message
+
+    yield Stream()
+
+
+def _gemini_generate_content(model: str, contents: Any, config: Any) -> Any:
+    parts = [gtypes.Part(function_call=gtypes.FunctionCall(name=name, args=args)) for _, name, args in CALLS]
+    return NS(
+        candidates=[NS(content=gtypes.Content(role="model", parts=parts), finish_reason="STOP")],
+        usage_metadata=NS(prompt_token_count=1, total_token_count=2, candidates_token_count=1),
+    )
+
+
+def _openai_client() -> Any:
+    output = [
+        NS(type="function_call", name=name, call_id=call_id, arguments=orjson.dumps(args).decode())
+        for call_id, name, args in CALLS
+    ]
+    response = NS(id="resp_1", output=output, usage=NS(input_tokens=1, output_tokens=1))
+    return NS(responses=NS(create=lambda **kwargs: response))
+
+
+def _xai_client() -> Any:
+    tool_calls = [
+        NS(id=call_id, function=NS(name=name, arguments=orjson.dumps(args).decode())) for call_id, name, args in CALLS
+    ]
+    response = NS(id="resp_1", tool_calls=tool_calls, usage=NS(prompt_tokens=1, completion_tokens=1, reasoning_tokens=0))
+    chat = NS(append=lambda message: None, sample=lambda: response)
+    return NS(chat=NS(create=lambda **kwargs: chat))
+
+
+class DuplicateEndTurnTest(unittest.TestCase):
+    """Todos los proveedores ejecutan end_turn una sola vez, después del resto de tools."""
+
+    def setUp(self) -> None:
+        self.sim = Simulator(load_config(CONFIG_PATH), np.random.default_rng(1))
+        self.tools = ToolExecutor(self.sim)
+
+    def _assert_end_turn_once_last(self, responder: Any) -> None:
+        actions, _, _ = responder.decide(self.sim._build_observation(), self.tools)
+        self.assertEqual([a["type"] for a in actions], ["set_prices", "end_turn"])
+        executed = [e["name"] for e in self.sim.agent_actions_trace if e["type"] == "tool_call"]
+        self.assertEqual(executed, ["set_prices", "end_turn"])
+
+    def test_anthropic(self) -> None:
+        client = NS(beta=NS(messages=NS(stream=_anthropic_stream)))
+        with mock.patch.object(AnthropicResponder, "_get_client", return_value=client):
+            self._assert_end_turn_once_last(AnthropicResponder("claude"))
+        # Cada tool_use tiene su tool_result, en el orden de las llamadas
+        results = self.sim.anthropic_messages[-1]["content"]
+        self.assertEqual([r["tool_use_id"] for r in results], ["c1", "c2", "c3"])
+
+    def test_gemini(self) -> None:
+        client = NS(models=NS(generate_content=_gemini_generate_content))
+        with mock.patch.dict(os.environ, {"GEMINI_API_KEY": "x"}), mock.patch.object(
+            gemini.genai, "Client", return_value=client
+        ):
+            self._assert_end_turn_once_last(GeminiResponder("gemini-2.5-flash"))
+        names = [p.function_response.name for p in self.sim.gemini_messages[-1].parts]
+        self.assertEqual(names, ["end_turn", "set_prices", "end_turn"])
+
+    def test_openai(self) -> None:
+        with mock.patch.object(OpenAIResponder, "_get_client", return_value=_openai_client()):
+            self._assert_end_turn_once_last(OpenAIResponder("gpt-5"))
+        # Las salidas pendientes responden a todas las function_call de la respuesta
+        self.assertEqual([o["call_id"] for o in self.sim.pending_tool_outputs], ["c1", "c2", "c3"])
+
+    def test_xai(self) -> None:
+        with mock.patch.object(XAIResponder, "_get_client", return_value=_xai_client()):
+            self._assert_end_turn_once_last(XAIResponder("grok-4"))
+
+
+if __name__ == "__main__":
+    unittest.main()
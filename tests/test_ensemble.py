@@ -0,0 +1,105 @@
+from __future__ import annotations
+
+import asyncio
+import pathlib
+import threading
+import unittest
+from typing import List, Optional
+from unittest import mock
+
+import numpy as np
+
+from agent import llm_agent
+from agent.llm_agent import EnsembleLLMAgent
+from sim.config import load_config
+from sim.engine import Simulator, ToolExecutor
+
+CONFIG_PATH = pathlib.Path(__file__).resolve().parents[1] / "configs" / "config.yml"
+
+# Tokens (entrada, salida) que devuelve cada modelo de prueba
+TOKENS = {"a": (10, 5), "b": (20, 7)}
+
+
+class BarrierResponder:
+    """
+    Responder sin API. Todos esperan en una barrera (si se ejecutaran en serie, se rompería)
+    y "b" cambia un precio. Cada uno encadena su conversación en previous_response_id.
+    """
+
+    barrier: Optional[threading.Barrier] = None
+
+    def __init__(self, model: str, reasoning_effort=None, debug: bool = False):
+        self.model = model
+        self.seen_previous: List[Optional[str]] = []
+
+    def decide(self, obs, tools, history=None):
+        if self.barrier is not None:
+            self.barrier.wait()
+        engine = tools.engine
+        self.seen_previous.append(engine.previous_response_id)
+        actions = []
+        if self.model == "b":
+            tools.set_prices({"pintxo": 9.0}, call_id="b")
+            actions.append({"type": "set_prices", "prices": {"pintxo": 9.0}})
+        tools.end_turn(call_id=self.model)
+        actions.append({"type": "end_turn"})
+        engine.previous_response_id = f"{self.model}-{obs['turn']}-{id(self)}"
+        return (actions, *TOKENS[self.model])
+
+
+class EnsembleTest(unittest.TestCase):
+    def setUp(self) -> None:
+        patcher = mock.patch.dict(llm_agent.PROVIDERS, {"stub": BarrierResponder})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.sim = Simulator(load_config(CONFIG_PATH), np.random.default_rng(1))
+        self.tools = ToolExecutor(self.sim)
+        self.ensemble = EnsembleLLMAgent([("stub", "a"), ("stub", "b"), ("stub", "b")])
+        self.addCleanup(self.ensemble.close)
+
+    def _play(self) -> list:
+        return self.ensemble.play_turn(self.sim._build_observation(), self.tools)
+
+    def test_members_decide_concurrently(self) -> None:
+        BarrierResponder.barrier = threading.Barrier(3, timeout=5)
+        self.addCleanup(setattr, BarrierResponder, "barrier", None)
+        self.assertEqual(self._play(), [{"type": "end_turn"}])
+
+    def test_play_turn_inside_a_running_event_loop(self) -> None:
+        async def main() -> list:
+            return self._play()
+
+        self.assertEqual(asyncio.run(main()), [{"type": "end_turn"}])
+
+    def test_members_are_isolated(self) -> None:
+        initial_price = self.sim.state.prices["pintxo"]
+        for _ in range(2):
+            self._play()
+
+        # El precio de "b" solo cambia en su engine en la sombra, no en el real
+        self.assertEqual(self.sim.state.prices["pintxo"], initial_price)
+        for idx in (1, 2):
+            self.assertEqual(self.ensemble._shadow_engines[idx].state.prices["pintxo"], 9.0)
+
+        # Cada miembro (aunque repita modelo) continúa su propia conversación
+        for agent in self.ensemble.agents:
+            seen = agent._responder.seen_previous
+            self.assertIsNone(seen[0])
+            self.assertTrue(seen[1].endswith(str(id(agent._responder))))
+
+        # Métricas por posición: los dos "b" no se mezclan
+        self.assertEqual(set(self.ensemble.member_metrics), {0, 1, 2})
+        self.assertEqual(self.ensemble.member_metrics[0]["tokens_in"], 20)
+        for idx in (1, 2):
+            self.assertEqual(self.ensemble.member_metrics[idx]["model"], "stub:b")
+            self.assertEqual(self.ensemble.member_metrics[idx]["tokens_in"], 40)
+            self.assertEqual(self.ensemble.member_metrics[idx]["tokens_out"], 14)
+        self.assertEqual(self.ensemble.last_member_actions[1][0]["type"], "set_prices")
+
+        # En el engine real solo se contabiliza el primario (vía LLMAgent.play_turn)
+        self.assertEqual(self.sim.metrics_tokens_in, 20)
+        self.assertEqual(self.sim.metrics_tokens_out, 10)
+
+
+if __name__ == "__main__":
+    unittest.main()
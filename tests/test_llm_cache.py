@@ -0,0 +1,242 @@
+from __future__ import annotations
+
+import contextlib
+import copy
+import pathlib
+import tempfile
+import types
+import unittest
+from unittest import mock
+
+import numpy as np
+
+from agent import llm_agent
+from agent.llm_agent import LLMAgent
+from agent.llm_cache import LLMCache, ShelveBackend
+from agent.message_format import format_observation_message
+from agent.providers.anthropic import AnthropicResponder
+from agent.providers.openai import OpenAIResponder
+from sim.config import load_config
+from sim.engine import Simulator, ToolExecutor
+
+CONFIG_PATH = pathlib.Path(__file__).resolve().parents[1] / "configs" / "config.yml"
+
+OBS_MSG = "Hora: 10:00\n\nHay 3 personas esperando para pedir en la cola del puesto."
+GPT_SCOPE = ("openai", "gpt-5", "low")
+CLAUDE_SCOPE = ("anthropic", "claude", "low")
+
+
+class CountingEmbedder:
+    """Embedder determinista (bolsa de palabras) que cuenta cuántas veces se llama."""
+
+    def __init__(self) -> None:
+        self.calls = 0
+
+    def __call__(self, text: str) -> np.ndarray:
+        self.calls += 1
+        vec = np.zeros(32, dtype=np.float32)
+        for word in text.split():
+            vec[sum(map(ord, word)) % 32] += 1.0
+        return vec
+
+
+class StubResponder:
+    """Responder sin API: fija un precio y termina el turno."""
+
+    def __init__(self, model: str, reasoning_effort=None, debug: bool = False):
+        self.calls = 0
+
+    def decide(self, obs, tools, history=None):
+        self.calls += 1
+        tools.set_prices({"pintxo": 3.0}, call_id="stub")
+        tools.end_turn(call_id="stub")
+        return [{"type": "set_prices", "prices": {"pintxo": 3.0}}, {"type": "end_turn"}], 10, 5
+
+    def record_replayed_turn(self, obs, actions, tools) -> None:
+        pass
+
+
+class SemanticScopeTest(unittest.TestCase):
+    def test_other_model_never_gets_a_semantic_hit(self) -> None:
+        with tempfile.TemporaryDirectory() as tmp:
+            path = pathlib.Path(tmp) / "cache"
+            cache = LLMCache(ShelveBackend(path), embedder=CountingEmbedder())
+            key = LLMCache.make_key(*GPT_SCOPE, OBS_MSG, None)
+            cache.set(key, {"actions": [{"type": "set_prices"}]}, obs_msg=OBS_MSG, scope=GPT_SCOPE)
+            cache.close()
+
+            # Se reabre el shelve: el índice semántico se reconstruye desde disco
+            cache = LLMCache(ShelveBackend(path), embedder=CountingEmbedder())
+            try:
+                other_key = LLMCache.make_key(*CLAUDE_SCOPE, OBS_MSG, None)
+                self.assertIsNone(cache.get(other_key))
+                self.assertIsNone(cache.semantic_get(OBS_MSG, scope=CLAUDE_SCOPE))
+                self.assertEqual(cache.stats["semantic_hits"], 0)
+                # El mismo modelo sí reutiliza su decisión
+                self.assertIsNotNone(cache.semantic_get(OBS_MSG, scope=GPT_SCOPE))
+            finally:
+                cache.close()
+
+    def test_resetting_a_key_replaces_its_index_row(self) -> None:
+        cache = LLMCache(embedder=CountingEmbedder())
+        for _ in range(3):
+            cache.set("k", {"actions": []}, obs_msg=OBS_MSG, scope=GPT_SCOPE)
+        keys, matrix = cache._semantic_index[GPT_SCOPE].matrix()
+        self.assertEqual(keys, ["k"])
+        self.assertEqual(matrix.shape[0], 1)
+
+
+class LLMAgentSemanticCacheTest(unittest.TestCase):
+    def _play(self, reasoning_effort: str) -> CountingEmbedder:
+        embedder = CountingEmbedder()
+        with mock.patch.dict(llm_agent.PROVIDERS, {"stub": StubResponder}):
+            agent = LLMAgent("stub", "m", reasoning_effort=reasoning_effort, cache=LLMCache(embedder=embedder))
+        sim = Simulator(load_config(CONFIG_PATH), np.random.default_rng(1))
+        agent.play_turn(sim._build_observation(), ToolExecutor(sim))
+        return embedder
+
+    def test_high_reasoning_skips_embeddings(self) -> None:
+        self.assertEqual(self._play("high").calls, 0)
+
+    def test_other_efforts_index_the_decision(self) -> None:
+        self.assertEqual(self._play("low").calls, 1)
+
+
+class LLMAgentExactCacheTest(unittest.TestCase):
+    def _agent(self, reasoning_effort, cache: LLMCache) -> LLMAgent:
+        with mock.patch.dict(llm_agent.PROVIDERS, {"stub": StubResponder}):
+            return LLMAgent("stub", "m", reasoning_effort=reasoning_effort, cache=cache)
+
+    def _sim(self, history: list) -> Simulator:
+        sim = Simulator(load_config(CONFIG_PATH), np.random.default_rng(1))
+        sim.anthropic_messages = history
+        return sim
+
+    def test_same_observation_with_other_history_misses(self) -> None:
+        cache = LLMCache()
+        agent = self._agent("low", cache)
+        for history in ([{"role": "user", "content": "turno A"}], [{"role": "user", "content": "turno B"}]):
+            sim = self._sim(list(history))
+            agent.play_turn(sim._build_observation(), ToolExecutor(sim))
+        self.assertEqual(cache.stats["hits"], 0)
+        self.assertEqual(agent._responder.calls, 2)
+
+        # Con el mismo historial sí se reutiliza la decisión
+        sim = self._sim([{"role": "user", "content": "turno A"}])
+        agent.play_turn(sim._build_observation(), ToolExecutor(sim))
+        self.assertEqual(cache.stats["hits"], 1)
+        self.assertEqual(agent._responder.calls, 2)
+
+    def test_non_deterministic_settings_skip_the_cache(self) -> None:
+        cache = LLMCache()
+        agent = self._agent(None, cache)
+        for _ in range(2):
+            sim = self._sim([])
+            agent.play_turn(sim._build_observation(), ToolExecutor(sim))
+        self.assertEqual(cache.stats, {"hits": 0, "misses": 0, "semantic_hits": 0})
+        self.assertEqual(agent._responder.calls, 2)
+
+
+NS = types.SimpleNamespace
+SET_PRICES_ARGS = {"prices": [{"product": "pintxo", "price": 3.5}]}
+
+
+@contextlib.contextmanager
+def _anthropic_stream(n: int):
+    content = [
+        NS(type="tool_use", name="set_prices", input=SET_PRICES_ARGS, id=f"sp{n}"),
+        NS(type="tool_use", name="end_turn", input={}, id=f"et{n}"),
+    ]
+    message = NS(
+        content=content,
+        usage=NS(input_tokens=1, output_tokens=1, cache_creation_input_tokens=None, cache_read_input_tokens=0),
+    )
+
+    class Stream:
+        def __iter__(self):
+            for i, block in enumerate(content):
+                yield NS(type="content_block_start", index=i)
+                yield NS(type="content_block_stop", index=i, content_block=block)
+
+        def get_final_message(self):
+            return message
+
+    yield Stream()
+
+
+class SemanticHitConversationTest(unittest.TestCase):
+    """Un hit semántico deja la conversación del proveedor lista para la siguiente llamada real."""
+
+    def _play_hit_then_miss(self, agent: LLMAgent) -> list:
+        sim = Simulator(load_config(CONFIG_PATH), np.random.default_rng(1))
+        tools = ToolExecutor(sim)
+        obs_msgs = []
+        for turn in range(3):
+            if turn == 2:
+                # A partir de aquí ninguna observación supera el umbral: fallo y llamada real
+                agent.cache.semantic_threshold = 1.01
+            sim.state.turn = turn
+            sim._end_turn_requested = False
+            tools.invalidate_cache()
+            obs = sim._build_observation()
+            obs_msgs.append(format_observation_message(obs))
+            agent.play_turn(obs, tools)
+        self.assertEqual(agent.cache.stats["semantic_hits"], 1)
+        return obs_msgs
+
+    def test_anthropic_history_is_well_formed(self) -> None:
+        requests = []
+
+        def stream(**kwargs):
+            requests.append(copy.deepcopy(kwargs["messages"]))
+            return _anthropic_stream(len(requests))
+
+        client = NS(beta=NS(messages=NS(stream=stream)))
+        with mock.patch.object(AnthropicResponder, "_get_client", return_value=client):
+            agent = LLMAgent("anthropic", "claude", reasoning_effort="low", cache=LLMCache(embedder=CountingEmbedder()))
+        obs_msgs = self._play_hit_then_miss(agent)
+
+        self.assertEqual(len(requests), 2)
+        history = requests[1]
+        self.assertEqual(history[0]["role"], "user")
+        for prev, msg in zip(history, history[1:]):
+            self.assertFalse(prev["role"] == msg["role"] == "assistant")
+            if prev["role"] == "assistant":
+                tool_use_ids = [b["id"] for b in prev["content"] if b["type"] == "tool_use"]
+                if tool_use_ids:
+                    self.assertEqual([r["tool_use_id"] for r in msg["content"]], tool_use_ids)
+        # El turno del hit queda como observación + respuesta del asistente
+        # (el último mensaje lleva la marca de prompt caching: texto en un bloque)
+        texts = [m["content"] if isinstance(m["content"], str) else m["content"][0].get("text") for m in history]
+        user_texts = [text for m, text in zip(history, texts) if m["role"] == "user" and text is not None]
+        self.assertEqual(user_texts, obs_msgs)
+        hit_idx = texts.index(obs_msgs[1])
+        self.assertEqual(history[hit_idx + 1]["role"], "assistant")
+        self.assertIn("set_prices", history[hit_idx + 1]["content"][0]["text"])
+
+    def test_openai_sends_the_replayed_turn(self) -> None:
+        requests = []
+
+        def create(**kwargs):
+            requests.append(copy.deepcopy(kwargs))
+            n = len(requests)
+            output = [
+                NS(type="function_call", name="set_prices", call_id=f"sp{n}", arguments='{"prices": []}'),
+                NS(type="function_call", name="end_turn", call_id=f"et{n}", arguments="{}"),
+            ]
+            return NS(id=f"resp_{n}", output=output, usage=NS(input_tokens=1, output_tokens=1))
+
+        with mock.patch.object(OpenAIResponder, "_get_client", return_value=NS(responses=NS(create=create))):
+            agent = LLMAgent("openai", "gpt-5", reasoning_effort="low", cache=LLMCache(embedder=CountingEmbedder()))
+        obs_msgs = self._play_hit_then_miss(agent)
+
+        self.assertEqual(len(requests), 2)
+        self.assertEqual(requests[1]["previous_response_id"], "resp_1")
+        sent = requests[1]["input"]
+        self.assertEqual([item.get("call_id") for item in sent[:2]], ["sp1", "et1"])
+        self.assertEqual([item["role"] for item in sent[2:]], ["user", "assistant", "user"])
+        self.assertEqual([sent[2]["content"], sent[4]["content"]], obs_msgs[1:])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,48 @@
+from __future__ import annotations
+
+import pathlib
+import unittest
+
+import numpy as np
+
+from sim.config import load_config
+from sim.engine import Simulator, ToolExecutor
+
+CONFIG_PATH = pathlib.Path(__file__).resolve().parents[1] / "configs" / "config.yml"
+
+
+class MemoizedToolsTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.sim = Simulator(load_config(CONFIG_PATH), np.random.default_rng(1))
+        self.tools = ToolExecutor(self.sim)
+
+    def test_mutating_get_status_result_does_not_leak(self) -> None:
+        result = self.tools.assign_workers([{"employee_id": 1, "task": "atender_clientes"}])
+        self.assertTrue(result["ok"], result)
+        self.sim.agent_actions_trace.clear()
+        first = self.tools.get_status(call_id="1")
+        expected = self.tools._copy_status(first)
+        first["cash"] = -1.0
+        for product in first["stock_on_hand"]:
+            first["stock_on_hand"][product] = -1
+        first["workers_on_trip"][99] = 1
+        self.assertTrue(first["worker_assignments"])
+        for assignment in first["worker_assignments"]:
+            assignment["task"] = "comprar"
+
+        self.assertEqual(self.tools.get_status(call_id="2"), expected)
+        self.assertEqual(self.sim.agent_actions_trace[0]["result"], expected)
+
+    def test_mutating_get_prices_result_does_not_leak(self) -> None:
+        first = self.tools.get_prices(call_id="1")
+        expected = dict(first["current_prices"])
+        for product in first["current_prices"]:
+            first["current_prices"][product] = 0.0
+
+        self.assertEqual(self.tools.get_prices(call_id="2")["current_prices"], expected)
+        self.assertEqual(self.sim.agent_actions_trace[0]["result"]["current_prices"], expected)
+        self.assertEqual(self.sim.state.prices, expected)
+
+
+if __name__ == "__main__":
+    unittest.main()